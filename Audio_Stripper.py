@@ -2,25 +2,70 @@
 """
 Audio Stripper - Extract audio from video files
 Supports various input formats (mp4, mov, avi, mkv, etc.)
-and output formats (mp3, wav, aac, flac, ogg)
+and output formats (mp3, wav, aac, m4a, flac, ogg)
+
+Extraction runs ffmpeg directly. When the source audio track is already
+in a codec the output format can hold, it is stream-copied instead of
+being decoded and re-encoded, so extraction runs at the speed of reading
+the file. tkinter is only imported when the file picker opens.
 """
 
+import time
+
+_IMPORT_START = time.perf_counter()
+
 import argparse
+import contextlib
+import io
 import os
+import shutil
+import struct
+import subprocess
 import sys
+import threading
 from pathlib import Path
-import tkinter as tk
-from tkinter import filedialog
 
-try:
-    from moviepy import VideoFileClip
-except ImportError as e:
-    print(f"Error: Cannot import moviepy: {e}")
-    print(f"\nPython executable: {sys.executable}")
-    print(f"Python version: {sys.version}")
-    print("\nTry installing moviepy for this Python interpreter:")
-    print(f"  {sys.executable} -m pip install moviepy")
-    sys.exit(1)
+import media_probe
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+
+# Inputs picked up by --recursive (and offered by the file picker)
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".flv", ".wmv", ".webm", ".m4v")
+
+# Output format -> ffmpeg audio encoder used when the track has to be re-encoded
+TRANSCODE_CODECS = {
+    "mp3": "libmp3lame",
+    "wav": "pcm_s16le",
+    "aac": "aac",
+    "m4a": "aac",
+    "flac": "flac",
+    "ogg": "libvorbis",
+}
+LOSSLESS_FORMATS = {"wav", "flac"}  # formats that ignore the bitrate
+
+# Waveform peak files (--peaks): min/max of every PEAKS_BLOCK mono samples, plus coarser levels that each
+# merge PEAKS_FACTOR entries of the level below, stored as int16 (min, max) pairs after a small header
+PEAKS_MAGIC = b"ASPK"
+PEAKS_VERSION = 1
+PEAKS_BLOCK = 256
+PEAKS_FACTOR = 4
+PEAKS_LEVELS = 6
+PEAKS_HEADER = struct.Struct("<4sHHIIIQ")  # magic, version, levels, sample rate, block, factor, total samples
+PEAKS_READ_BYTES = 1 << 20  # PCM pipe read size while building peaks
+
+# Source audio codec -> output formats that can hold it without re-encoding
+STREAM_COPY_FORMATS = {
+    "aac": {"aac", "m4a"},
+    "mp3": {"mp3"},
+    "flac": {"flac"},
+    "vorbis": {"ogg"},
+    "opus": {"ogg"},
+    "pcm_s16le": {"wav"},
+    "pcm_s24le": {"wav"},
+    "pcm_s32le": {"wav"},
+    "pcm_f32le": {"wav"},
+}
 
 
 def select_files_gui():
@@ -30,6 +75,9 @@ def select_files_gui():
     Returns:
         list: List of selected file paths, or empty list if cancelled
     """
+    import tkinter as tk
+    from tkinter import filedialog
+    
     # Hide the root tkinter window
     root = tk.Tk()
     root.withdraw()
@@ -40,7 +88,7 @@ def select_files_gui():
     file_paths = filedialog.askopenfilenames(
         title="Select video file(s) to extract audio from",
         filetypes=[
-            ("Video files", "*.mp4 *.mov *.avi *.mkv *.flv *.wmv *.webm *.m4v"),
+            ("Video files", " ".join(f"*{ext}" for ext in VIDEO_EXTENSIONS)),
             ("MP4 files", "*.mp4"),
             ("MOV files", "*.mov"),
             ("All files", "*.*")
@@ -52,68 +100,498 @@ def select_files_gui():
     return list(file_paths) if file_paths else []
 
 
-def extract_audio(input_file, output_file=None, output_format="mp3", bitrate="192k"):
+def _read_blocks(pipe, buffer, frame_bytes):
     """
-    Extract audio from a video file and save it as a separate audio file.
+    Fill buffer from a pipe over and over.
+    
+    Yields:
+        int: Bytes of whole frames now at the start of buffer (the last fill may be short)
+    """
+    view = memoryview(buffer)
+    while True:
+        filled = 0
+        while filled < len(buffer):
+            n = pipe.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        usable = filled - filled % frame_bytes
+        if usable:
+            yield usable
+        if filled < len(buffer):
+            return
+
+
+def _start_stderr_drain(proc):
+    """
+    Read a process's stderr to the end on a background thread, so ffmpeg
+    can't stall on a full pipe while its stdout is being consumed.
+    
+    Returns:
+        callable: Joins the thread and returns stderr as text
+    """
+    errors = []
+    drain = threading.Thread(target=lambda: errors.append(proc.stderr.read()), daemon=True)
+    drain.start()
+    
+    def result():
+        drain.join()
+        proc.stderr.close()
+        return b"".join(errors).decode(errors="replace")
+    
+    return result
+
+
+def run_ffmpeg_audio(input_file, outputs, pcm_consumer=None, pcm_rate=44100):
+    """
+    Write the first audio track of a file to one or more outputs in a single
+    ffmpeg run, so the input is demuxed (and decoded, for outputs that
+    re-encode) only once.
     
     Args:
         input_file (str): Path to the input video file
-        output_file (str): Path to the output audio file (optional)
-        output_format (str): Audio format (mp3, wav, aac, flac, ogg)
+        outputs (list): (output_path, codec_args) pairs; the extension of
+            output_path picks the container and codec_args are ffmpeg audio
+            codec arguments (e.g. ["-c:a", "copy"])
+        pcm_consumer (callable): Optional; also decode the track to mono
+            16-bit PCM at pcm_rate in the same run and pass it to
+            pcm_consumer in blocks (a memoryview reused between calls)
+        pcm_rate (int): Sample rate of the PCM passed to pcm_consumer
+    
+    Raises:
+        ValueError: If the file has no audio track
+        RuntimeError: If ffmpeg is missing or fails
+    """
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg not found on PATH")
+    cmd = ["ffmpeg", "-v", "error", "-nostdin", "-y", "-i", str(input_file)]
+    for output_path, codec_args in outputs:
+        cmd += ["-map", "0:a:0", "-vn", "-sn", "-dn", *codec_args, str(output_path)]
+    if pcm_consumer is None:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        returncode, stderr = result.returncode, result.stderr
+    else:
+        cmd += ["-map", "0:a:0", "-vn", "-sn", "-dn", "-ac", "1", "-ar", str(pcm_rate),
+                "-f", "s16le", "-c:a", "pcm_s16le", "pipe:1"]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+        stderr_text = _start_stderr_drain(proc)
+        buffer = bytearray(PEAKS_READ_BYTES)
+        finished = False
+        try:
+            for n in _read_blocks(proc.stdout, buffer, 2):
+                pcm_consumer(memoryview(buffer)[:n])
+            finished = True
+        finally:
+            proc.stdout.close()
+            if not finished:
+                proc.kill()
+            proc.wait()
+        returncode, stderr = proc.returncode, stderr_text()
+    if returncode != 0:
+        if "matches no streams" in stderr:
+            raise ValueError("The video file has no audio track")
+        raise RuntimeError(f"ffmpeg failed: {stderr.strip()}")
+
+
+def transcode_args(output_format, bitrate):
+    """
+    ffmpeg codec arguments to re-encode audio into output_format.
+    
+    Args:
+        output_format (str): Audio format (mp3, wav, aac, m4a, flac, ogg)
         bitrate (str): Audio bitrate for lossy formats (e.g., "192k", "320k")
     
     Returns:
-        str: Path to the output audio file
+        list: ffmpeg arguments
+    """
+    codec_args = ["-c:a", TRANSCODE_CODECS[output_format]]
+    if output_format not in LOSSLESS_FORMATS:
+        codec_args += ["-b:a", bitrate]
+    return codec_args
+
+
+class PeakBuilder:
+    """
+    Multi-resolution min/max peaks over a stream of mono 16-bit samples.
+    
+    Only the finest level is accumulated while samples arrive (4 bytes per
+    PEAKS_BLOCK samples); the coarser levels are reduced from it at the end.
+    """
+    
+    def __init__(self, sample_rate, block=PEAKS_BLOCK, factor=PEAKS_FACTOR, levels=PEAKS_LEVELS):
+        import numpy as np
+        
+        self._np = np
+        self.sample_rate = sample_rate
+        self.block = block
+        self.factor = factor
+        self.levels = levels
+        self.total_samples = 0
+        self._carry = np.empty(0, dtype=np.int16)
+        self._blocks = []
+    
+    def add_bytes(self, data):
+        """
+        Add s16le samples.
+        
+        Args:
+            data (bytes-like): Little-endian int16 samples; not kept after the call
+        """
+        np = self._np
+        samples = np.frombuffer(data, dtype="<i2")
+        self.total_samples += len(samples)
+        if len(self._carry):
+            samples = np.concatenate([self._carry, samples])
+        whole = len(samples) - len(samples) % self.block
+        if whole:
+            blocks = samples[:whole].reshape(-1, self.block)
+            self._blocks.append(np.stack([blocks.min(axis=1), blocks.max(axis=1)], axis=1))
+        self._carry = samples[whole:].copy()
+    
+    def build(self):
+        """
+        Returns:
+            list: One (count, 2) int16 array of (min, max) per level, finest first
+        """
+        np = self._np
+        parts = list(self._blocks)
+        if len(self._carry):
+            parts.append(np.array([[self._carry.min(), self._carry.max()]], dtype=np.int16))
+        level = np.concatenate(parts) if parts else np.zeros((0, 2), dtype=np.int16)
+        result = [level.astype("<i2")]
+        for _ in range(self.levels - 1):
+            if len(level) <= 1:
+                break
+            # Pad with the last entry so the partial group at the end keeps its own min/max
+            pad = -len(level) % self.factor
+            grouped = np.pad(level, ((0, pad), (0, 0)), mode="edge").reshape(-1, self.factor, 2)
+            level = np.stack([grouped[:, :, 0].min(axis=1), grouped[:, :, 1].max(axis=1)], axis=1)
+            result.append(level.astype("<i2"))
+        return result
+    
+    def write(self, path):
+        """
+        Write the peak file (see load_peaks for the layout).
+        
+        Args:
+            path (str): Output path; written to a temp file and renamed into place
+        """
+        levels = self.build()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(PEAKS_HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, len(levels), self.sample_rate,
+                                      self.block, self.factor, self.total_samples))
+            f.write(struct.pack(f"<{len(levels)}Q", *(len(level) for level in levels)))
+            for level in levels:
+                f.write(level.tobytes())
+        os.replace(tmp_path, path)
+
+
+def load_peaks(path):
+    """
+    Memory-map a peak file written by --peaks.
+    
+    Layout: PEAKS_HEADER, one uint64 entry count per level, then each level
+    as little-endian int16 (min, max) pairs, finest level first. Entry i of
+    level k covers samples [i * block * factor**k, (i + 1) * block * factor**k).
+    
+    Args:
+        path (str): Path to the .peaks file
+    
+    Returns:
+        dict: sample_rate, block, factor, total_samples, and levels (a list
+            of read-only (count, 2) int16 arrays mapped from the file)
+    
+    Raises:
+        ValueError: If the file is not a peak file of a supported version
+    """
+    import numpy as np
+    
+    with open(path, "rb") as f:
+        header = f.read(PEAKS_HEADER.size)
+        if len(header) < PEAKS_HEADER.size:
+            raise ValueError(f"Not a peak file: {path}")
+        magic, version, n_levels, sample_rate, block, factor, total_samples = PEAKS_HEADER.unpack(header)
+        if magic != PEAKS_MAGIC or version != PEAKS_VERSION:
+            raise ValueError(f"Not a supported peak file: {path}")
+        counts = struct.unpack(f"<{n_levels}Q", f.read(8 * n_levels))
+    offset = PEAKS_HEADER.size + 8 * n_levels
+    levels = []
+    for count in counts:
+        if count:
+            levels.append(np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(count, 2)))
+        else:
+            levels.append(np.zeros((0, 2), dtype="<i2"))
+        offset += count * 4
+    return {
+        "sample_rate": sample_rate,
+        "block": block,
+        "factor": factor,
+        "total_samples": total_samples,
+        "levels": levels,
+    }
+
+
+def extract_audio(input_file, output_file=None, output_format="mp3", bitrate="192k", transcode=False, peaks=False):
+    """
+    Extract audio from a video file and save it as a separate audio file.
+    
+    The audio track is stream-copied when its codec fits the output format
+    (see STREAM_COPY_FORMATS); bitrate only applies when it is re-encoded.
+    Several formats are written from one ffmpeg pass over the input.
+    
+    Args:
+        input_file (str): Path to the input video file
+        output_file (str): Path to the output audio file (optional, single format only).
+            A known extension (.wav, .flac, ...) overrides output_format
+        output_format (str or list): Audio format (mp3, wav, aac, m4a, flac, ogg),
+            or a list of formats to write at once
+        bitrate (str or dict): Audio bitrate for lossy formats (e.g., "192k", "320k"),
+            or {format: bitrate} with an optional None key for the rest
+        transcode (bool): Always re-encode, even when the track could be copied
+        peaks (bool): Also write a waveform peak file (<output>.peaks, see
+            load_peaks) from the same ffmpeg pass
+    
+    Returns:
+        str: Path to the output audio file (a list of paths when output_format is a list)
     """
     input_path = Path(input_file)
+    formats = [output_format] if isinstance(output_format, str) else list(output_format)
     
     # Check if input file exists
     if not input_path.exists():
         raise FileNotFoundError(f"Input file not found: {input_file}")
+    if output_file is not None and len(formats) > 1:
+        raise ValueError("An output file name only works with a single output format")
+    if output_file is not None:
+        # The file extension picks the codec, as moviepy's write_audiofile did, so "-o output.wav" writes PCM
+        # even with the default mp3 format instead of MP3 data in a WAV container
+        suffix_format = Path(output_file).suffix.lower().lstrip(".")
+        if suffix_format in TRANSCODE_CODECS:
+            formats = [suffix_format]
     
-    # Generate output filename if not provided
+    # Generate output filenames if not provided
     if output_file is None:
-        output_file = input_path.stem + f"_audio.{output_format}"
-        output_path = input_path.parent / output_file
+        output_paths = {fmt: input_path.parent / (input_path.stem + f"_audio.{fmt}") for fmt in formats}
     else:
-        output_path = Path(output_file)
+        output_paths = {formats[0]: Path(output_file)}
+    
+    def bitrate_for(fmt):
+        if isinstance(bitrate, dict):
+            return bitrate.get(fmt, bitrate.get(None, "192k"))
+        return bitrate
     
     print(f"Extracting audio from: {input_file}")
-    print(f"Output file: {output_path}")
+    for path in output_paths.values():
+        print(f"Output file: {path}")
     
+    start = time.perf_counter()
+    info = None
     try:
-        # Load the video file
-        video = VideoFileClip(str(input_path))
-        
-        # Check if video has audio
-        if video.audio is None:
-            video.close()
-            raise ValueError("The video file has no audio track")
-        
-        # Extract and save audio
-        audio = video.audio
-        
-        # Save with appropriate parameters based on format
-        if output_format in ["mp3", "aac", "ogg"]:
-            audio.write_audiofile(
-                str(output_path),
-                bitrate=bitrate
-            )
-        else:
-            audio.write_audiofile(
-                str(output_path)
-            )
-        
-        # Clean up
-        audio.close()
-        video.close()
-        
-        print(f"✓ Audio extracted successfully: {output_path}")
-        return str(output_path)
-        
+        info = media_probe.probe(str(input_path))
+    except media_probe.ProbeError as e:
+        print(f"Could not probe audio ({e}), transcoding")
+    if info is not None and not info.has_audio:
+        raise ValueError("The video file has no audio track")
+    codec = info.audio_codec if info is not None and not transcode else None
+    peaks_path = output_paths[formats[0]].with_suffix(".peaks") if peaks else None
+    peaks_rate = (info.sample_rate if info is not None else None) or 44100
+    peak_builder = None
+    copy_formats = {fmt for fmt in formats if fmt in STREAM_COPY_FORMATS.get(codec, ())}
+    
+    def outputs():
+        return [
+            (output_paths[fmt], ["-c:a", "copy"] if fmt in copy_formats else transcode_args(fmt, bitrate_for(fmt)))
+            for fmt in formats
+        ]
+    
+    def run():
+        nonlocal peak_builder
+        consumer = None
+        if peaks:
+            peak_builder = PeakBuilder(peaks_rate)
+            consumer = peak_builder.add_bytes
+        run_ffmpeg_audio(input_path, outputs(), pcm_consumer=consumer, pcm_rate=peaks_rate)
+    
+    try:
+        try:
+            run()
+        except RuntimeError as e:
+            if not copy_formats:
+                raise
+            print(f"{e}\nFalling back to transcoding")
+            copy_formats = set()
+            run()
+        if peak_builder is not None:
+            peak_builder.write(peaks_path)
     except Exception as e:
         print(f"Error extracting audio: {e}")
         raise
+    
+    # Throughput is measured against the input size, i.e. how fast the video is read through
+    seconds = time.perf_counter() - start
+    size_mb = input_path.stat().st_size / (1024 * 1024)
+    for fmt in formats:
+        mode = f"stream copy, {codec}" if fmt in copy_formats else f"transcoded, {TRANSCODE_CODECS[fmt]}"
+        print(f"✓ Audio extracted successfully ({mode}): {output_paths[fmt]}")
+    if peaks_path is not None:
+        print(f"✓ Waveform peaks written: {peaks_path}")
+    print(f"  {size_mb:.1f} MB in {seconds:.2f}s ({size_mb / max(seconds, 1e-6):.1f} MB/s)")
+    paths = [str(output_paths[fmt]) for fmt in formats]
+    return paths[0] if isinstance(output_format, str) else paths
+
+
+def iter_audio_chunks(input_file, sr=44100, channels=2, chunk_seconds=1.0):
+    """
+    Stream the first audio track of a file as float32 PCM blocks.
+    
+    ffmpeg decodes (and resamples/remixes to sr and channels) into a pipe,
+    which is read into one reused buffer, so memory stays at one chunk no
+    matter how long the file is and nothing is written to disk.
+    
+    Args:
+        input_file (str): Path to the input video (or audio) file
+        sr (int): Sample rate to resample to
+        channels (int): Channel count to mix to
+        chunk_seconds (float): Length of each block
+    
+    Yields:
+        numpy.ndarray: float32 array of shape (frames, channels). It is a
+            view of the reused buffer and is overwritten by the next block;
+            copy it to keep it. The last block may be shorter.
+    
+    Raises:
+        FileNotFoundError: If the input file doesn't exist
+        ValueError: If the file has no audio track
+        RuntimeError: If ffmpeg is missing or fails
+    """
+    import numpy as np
+    
+    if not Path(input_file).exists():
+        raise FileNotFoundError(f"Input file not found: {input_file}")
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg not found on PATH")
+    
+    frame_bytes = 4 * channels
+    chunk_frames = max(1, int(round(sr * chunk_seconds)))
+    buffer = bytearray(chunk_frames * frame_bytes)
+    proc = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-nostdin", "-i", str(input_file),
+         "-map", "0:a:0", "-vn", "-sn", "-dn", "-ac", str(channels), "-ar", str(sr),
+         "-f", "f32le", "-c:a", "pcm_f32le", "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+    )
+    stderr_text = _start_stderr_drain(proc)
+    finished = False
+    try:
+        for n in _read_blocks(proc.stdout, buffer, frame_bytes):
+            frames = n // frame_bytes
+            yield np.frombuffer(buffer, dtype=np.float32, count=frames * channels).reshape(frames, channels)
+        finished = True
+    finally:
+        proc.stdout.close()
+        if not finished:
+            proc.kill()  # consumer stopped early
+        proc.wait()
+        stderr = stderr_text()
+    if proc.returncode != 0:
+        if "matches no streams" in stderr:
+            raise ValueError("The video file has no audio track")
+        raise RuntimeError(f"ffmpeg failed: {stderr.strip()}")
+
+
+def find_videos(directory):
+    """
+    Find video files under a directory, recursively.
+    
+    Args:
+        directory (str): Folder to search
+    
+    Returns:
+        list: Paths of files with a VIDEO_EXTENSIONS extension, sorted
+    """
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def process_file(input_file, output_file, output_format, bitrate, transcode, peaks=False, capture=False):
+    """
+    Run extract_audio for one file as a batch item.
+    
+    Args:
+        input_file (str): Path to the input video file
+        output_file (str): Path to the output audio file (optional)
+        output_format (str or list): Audio format(s)
+        bitrate (str or dict): Audio bitrate(s) for lossy formats
+        transcode (bool): Always re-encode
+        peaks (bool): Also write a waveform peak file
+        capture (bool): Collect the printed output instead of printing it, so
+            pool workers' output can be printed in input order
+    
+    Returns:
+        tuple: (succeeded, captured output or "")
+    """
+    out = io.StringIO() if capture else sys.stdout
+    with contextlib.redirect_stdout(out):
+        try:
+            extract_audio(
+                input_file,
+                output_file=output_file,
+                output_format=output_format,
+                bitrate=bitrate,
+                transcode=transcode,
+                peaks=peaks
+            )
+            ok = True
+        except Exception as e:
+            print(f"Failed to process {input_file}: {e}")
+            ok = False
+    return ok, out.getvalue() if capture else ""
+
+
+def parse_formats(value):
+    """
+    argparse type for -f: one format or a comma-separated list.
+    
+    Returns:
+        list: Output formats, in the order given, without duplicates
+    """
+    formats = []
+    for fmt in value.lower().split(","):
+        fmt = fmt.strip()
+        if fmt not in TRANSCODE_CODECS:
+            raise argparse.ArgumentTypeError(
+                f"invalid format {fmt!r} (choose from {', '.join(TRANSCODE_CODECS)})"
+            )
+        if fmt not in formats:
+            formats.append(fmt)
+    return formats
+
+
+def parse_bitrates(value):
+    """
+    argparse type for -b: "192k" for every lossy format, or per-format
+    settings such as "mp3=320k,ogg=160k", optionally with a default ("160k,mp3=320k").
+    
+    Returns:
+        dict: {format: bitrate}, with the default under None
+    """
+    bitrates = {None: "192k"}
+    for item in value.split(","):
+        item = item.strip()
+        fmt, sep, rate = item.rpartition("=")
+        fmt = fmt.strip().lower() if sep else None
+        if fmt is not None and fmt not in TRANSCODE_CODECS:
+            raise argparse.ArgumentTypeError(f"invalid format {fmt!r} in bitrate {item!r}")
+        if not rate.strip():
+            raise argparse.ArgumentTypeError(f"missing bitrate in {item!r}")
+        bitrates[fmt] = rate.strip()
+    return bitrates
 
 
 def main():
@@ -134,15 +612,45 @@ Examples:
   # Extract audio as MP3 with high quality
   python Audio_Stripper.py video.mp4 -f mp3 -b 320k
   
+  # MP3 for upload, WAV for editing and FLAC for archive from one pass
+  python Audio_Stripper.py video.mp4 -f mp3,wav,flac -b mp3=320k
+  
+  # Also write waveform peaks for the review tool
+  python Audio_Stripper.py video.mp4 -f wav --peaks
+  
+  # Copy an AAC track out of an MP4 without re-encoding
+  python Audio_Stripper.py video.mp4 -f m4a
+  
+  # Re-encode even if the track could be copied (e.g. to change the bitrate)
+  python Audio_Stripper.py video.mp4 -f m4a -b 128k --transcode
+  
   # Process multiple files
   python Audio_Stripper.py video1.mp4 video2.mov video3.avi
+  
+  # Every video under a folder, 8 at a time
+  python Audio_Stripper.py --recursive downloads/ --jobs 8
         """
     )
     
     parser.add_argument(
         "input_files",
         nargs="*",  # Changed from "+" to "*" to make it optional
-        help="Input video file(s). If omitted, a file picker will open."
+        help="Input video file(s). If omitted (and no --recursive), a file picker will open."
+    )
+    
+    parser.add_argument(
+        "-r", "--recursive",
+        metavar="DIR",
+        action="append",
+        default=[],
+        help="Also process every video file under DIR (can be repeated)"
+    )
+    
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of files to extract in parallel (default: 1)"
     )
     
     parser.add_argument(
@@ -152,15 +660,30 @@ Examples:
     
     parser.add_argument(
         "-f", "--format",
-        choices=["mp3", "wav", "aac", "flac", "ogg"],
+        type=parse_formats,
         default="mp3",
-        help="Output audio format (default: mp3)"
+        help="Output audio format(s), comma-separated for several at once: "
+             "mp3, wav, aac, m4a, flac, ogg (default: mp3)"
     )
     
     parser.add_argument(
         "-b", "--bitrate",
+        type=parse_bitrates,
         default="192k",
-        help="Audio bitrate for lossy formats (default: 192k)"
+        help="Audio bitrate for lossy formats when re-encoding, either one value or "
+             "per format like mp3=320k,ogg=160k (default: 192k)"
+    )
+    
+    parser.add_argument(
+        "-t", "--transcode",
+        action="store_true",
+        help="Always re-encode the audio, even when the source track could be stream-copied"
+    )
+    
+    parser.add_argument(
+        "-p", "--peaks",
+        action="store_true",
+        help="Also write a waveform peak file (<output>.peaks) from the same pass, for fast overviews"
     )
     
     parser.add_argument(
@@ -171,39 +694,64 @@ Examples:
     
     args = parser.parse_args()
     
+    print(f"Startup: module imports took {IMPORT_SECONDS * 1000:.1f} ms")
+    
+    for directory in args.recursive:
+        if not os.path.isdir(directory):
+            print(f"Error: Not a directory: {directory}")
+            sys.exit(1)
+        args.input_files.extend(find_videos(directory))
+    
     # If no input files provided or --gui flag used, open file picker
-    if not args.input_files or args.gui:
+    if (not args.input_files and not args.recursive) or args.gui:
         selected_files = select_files_gui()
         if not selected_files:
             print("No files selected. Exiting.")
             sys.exit(0)
         args.input_files = selected_files
     
-    # Check if output file is specified with multiple inputs
+    # Check if output file is specified with multiple inputs or formats
     if args.output and len(args.input_files) > 1:
         print("Error: Cannot specify output file with multiple input files")
         sys.exit(1)
+    if args.output and len(args.format) > 1:
+        print("Error: Cannot specify output file with multiple output formats")
+        sys.exit(1)
+    
+    if not args.input_files:
+        print("No video files found. Exiting.")
+        sys.exit(0)
     
     success_count = 0
     fail_count = 0
+    batch_start = time.perf_counter()
+    options = (args.output, args.format, args.bitrate, args.transcode, args.peaks)
     
-    for input_file in args.input_files:
-        try:
-            extract_audio(
-                input_file,
-                output_file=args.output,
-                output_format=args.format,
-                bitrate=args.bitrate
+    if args.jobs > 1 and len(args.input_files) > 1:
+        # Workers capture their output; map() hands results back in input order
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = pool.map(
+                process_file,
+                args.input_files,
+                *[[option] * len(args.input_files) for option in options],
+                [True] * len(args.input_files)
             )
-            success_count += 1
-        except Exception as e:
-            print(f"Failed to process {input_file}: {e}")
-            fail_count += 1
-        print()  # Empty line between files
+            for ok, output in results:
+                print(output)  # Empty line between files
+                success_count += ok
+                fail_count += not ok
+    else:
+        for input_file in args.input_files:
+            ok, _ = process_file(input_file, *options)
+            success_count += ok
+            fail_count += not ok
+            print()  # Empty line between files
     
     # Print summary if multiple files
     if len(args.input_files) > 1:
-        print(f"Summary: {success_count} succeeded, {fail_count} failed")
+        print(f"Summary: {success_count} succeeded, {fail_count} failed "
+              f"in {time.perf_counter() - batch_start:.2f}s")
     
     sys.exit(0 if fail_count == 0 else 1)
 
@@ -1,5 +1,16 @@
+import array
+import contextlib
+import math
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import ffmpeg
+import file_cache
+import media_probe
+import mp4_output
 
 
 # Settings
@@ -10,61 +21,87 @@ RAW_FOLDER = "raw_asmr"
 OUTPUT_FOLDER = "ready_asmr"
 DELETE_OLD_VIDEOS = False  # Set to True to delete processed videos from raw_asmr
 
+# Cover segments depend only on the image and the encode settings, so they are cached (by a hash of those) and
+# reused across videos and runs. The cache is kept under COVER_CACHE_MAX_MB, least recently used first.
+USE_COVER_CACHE = True
+COVER_CACHE_DIR = os.environ.get(
+    'ASMR_COVER_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'video_creation_help', 'asmr_covers'),
+)
+COVER_CACHE_MAX_MB = 512
+
 # Encoding knobs
 FPS = 30                 # target output fps
 CRF = 20                 # visual quality for x264 (lower is higher quality)
 ABR = "192k"             # audio bitrate
 ENCODER = "libx264"      # keep software x264 for best quality; optional: "h264_videotoolbox"
 PRESET = "faster"        # faster uses less CPU at same CRF (larger files, same quality)
-THREADS = 3              # 0=auto; set to a small number to reduce CPU spikes
+THREADS = 3              # 0=auto; threads per ffmpeg call when a function is used on its own
 USE_HWACCEL_DECODE = True  # use macOS VideoToolbox for hardware-accelerated decode
 
+# Reverse memory: ffmpeg's reverse filter keeps every decoded frame of the clip in RAM. When the clip's
+# decoded frames would exceed REVERSE_MAX_MEMORY_MB it is reversed in chunks that fit instead, and the
+# reversed chunks are joined back to front.
+REVERSE_MAX_MEMORY_MB = 2048
+REVERSE_CHUNK_SECONDS = 0  # fixed chunk length; 0 = largest chunk that fits REVERSE_MAX_MEMORY_MB
+REVERSE_AUDIO_BLOCK_FRAMES = 1 << 20  # audio frames (8 MB of stereo float) read per block when reversing on disk
+
+# Scheduling: up to PIPELINE_VIDEOS raw videos are in flight at once, so the next video's probe and cover run
+# while the current unit encodes, and within a video the cover and unit encode concurrently. Every encode takes
+# its threads (used for its decoder, filter graph and encoder alike) and, for the reverse filter, its
+# decoded-frame memory from one shared budget.
+THREAD_BUDGET = int(os.environ.get('ASMR_THREAD_BUDGET', 0)) or os.cpu_count() or 4
+MEMORY_BUDGET_MB = int(os.environ.get('ASMR_MEMORY_BUDGET_MB', 0)) or 0  # 0 = half of physical RAM
+PIPELINE_VIDEOS = 2
+
 # Output size budget
 MAX_OUTPUT_SIZE_GB = 1.0   # hard cap for final file size
 SIZE_SAFETY = 0.98         # safety factor to stay under the cap
+# The output is the cover plus repeats of one unit, so its size is known from the encoded segments before the
+# concat runs. When the prediction is over the cap, or under PLAN_MIN_FILL of it, the unit is re-encoded at a
+# corrected bitrate (at most PLAN_MAX_PASSES times per video).
+PLAN_OUTPUT_SIZE = True
+PLAN_MIN_FILL = 0.90
+PLAN_MAX_PASSES = 2
+MIN_VIDEO_BPS = 600_000
 
-
-def _parse_fps(rate_str):
-    try:
-        if not rate_str or rate_str == "0/0":
-            return None
-        if "/" in rate_str:
-            n, d = rate_str.split("/")
-            return float(n) / float(d) if float(d) != 0 else None
-        return float(rate_str)
-    except Exception:
-        return None
+# Outputs per raw video as (minutes, max size GB). Every target is a remux of the same cover and unit, which are
+# encoded once at the bitrate of the tightest target, e.g. [(10, 0.4), (30, 1.0), (60, 2.0)].
+# With more than one target the outputs are named asmr_<minutes>min_<video>.
+TARGETS = [(TOTAL_MINUTES, MAX_OUTPUT_SIZE_GB)]
 
 
 def probe_video(path):
-    p = ffmpeg.probe(path)
-    vstreams = [s for s in p["streams"] if s["codec_type"] == "video"]
-    astreams = [s for s in p["streams"] if s["codec_type"] == "audio"]
-    if not vstreams:
+    info = media_probe.probe(path)
+    if not info.has_video:
         raise RuntimeError("no video stream")
-    width = int(vstreams[0]["width"]) 
-    height = int(vstreams[0]["height"]) 
-    src_fps = _parse_fps(vstreams[0].get("avg_frame_rate") or vstreams[0].get("r_frame_rate"))
-    dur = p.get("format", {}).get("duration")
-    if dur:
-        duration = float(dur)
-    else:
-        duration = float(vstreams[0].get("duration", 0) or 0)
-        if not duration:
-            duration = 5.0
-    has_audio = len(astreams) > 0
-    a_rate = int(astreams[0].get("sample_rate")) if has_audio and astreams[0].get("sample_rate") else None
-    a_ch = astreams[0].get("channels") if has_audio else None
-    a_codec = astreams[0].get("codec_name") if has_audio else None
-    return width, height, duration, has_audio, src_fps, a_rate, a_ch, a_codec
+    duration = info.duration or info.video_duration or 5.0
+    return info.width, info.height, duration, info.has_audio, info.fps, info.sample_rate, info.channels, info.audio_codec
 
 
-def _maybe_global(stream):
+def _maybe_global(stream, threads=None):
     if USE_HWACCEL_DECODE:
         stream = stream.global_args('-hwaccel', 'videotoolbox')
+    threads = _thread_arg(threads)
+    if threads:
+        # Filter graphs otherwise start one thread per CPU in every ffmpeg process
+        stream = stream.global_args('-filter_threads', str(threads), '-filter_complex_threads', str(threads))
     return stream
 
 
+def _thread_arg(threads):
+    # ffmpeg -threads value: the per-call count, THREADS when not given, None (ffmpeg's auto) for 0
+    threads = THREADS if threads is None else threads
+    return threads if threads > 0 else None
+
+
+def _thread_opts(threads):
+    # -threads for an input (its decoder) or an output (its encoder); nothing for ffmpeg's auto. Decoder, filter
+    # graph and encoder all get the share, so one ffmpeg process stays within the threads it reserved.
+    threads = _thread_arg(threads)
+    return {"threads": threads} if threads else {}
+
+
 def _parse_abr_to_bps(abr: str) -> int:
     # e.g., "192k" -> 192000, "128000" -> 128000
     s = abr.strip().lower()
@@ -75,26 +112,27 @@ def _parse_abr_to_bps(abr: str) -> int:
     return int(float(s))
 
 
-def compute_bitrate_budget(total_seconds: float, audio_bps: int) -> tuple[str, str, str]:
-    # Compute target video bitrate to keep final size under MAX_OUTPUT_SIZE_GB
-    max_bytes = int(MAX_OUTPUT_SIZE_GB * SIZE_SAFETY * (1024 ** 3))
+def compute_bitrate_budget(total_seconds: float, audio_bps: int, max_gb: float = None) -> tuple[str, str, str]:
+    # Compute target video bitrate to keep final size under max_gb (default MAX_OUTPUT_SIZE_GB)
+    max_bytes = int((max_gb or MAX_OUTPUT_SIZE_GB) * SIZE_SAFETY * (1024 ** 3))
     if total_seconds <= 0:
         total_seconds = 1
     total_bits_budget = max_bytes * 8
     video_bps = int(total_bits_budget / total_seconds) - audio_bps
-    # Clamp to sane bounds
-    min_bps = 600_000
-    if video_bps < min_bps:
-        video_bps = min_bps
-    # Build ffmpeg arg strings
+    return bitrate_args(video_bps)
+
+
+def bitrate_args(video_bps: int) -> tuple[str, str, str]:
+    # Clamp to sane bounds and build the ffmpeg (b:v, maxrate, bufsize) strings
+    video_bps = max(int(video_bps), MIN_VIDEO_BPS)
     vb = f"{video_bps // 1000}k"
     maxrate = vb
     bufsize = f"{(video_bps * 2) // 1000}k"
     return vb, maxrate, bufsize
 
 
-def make_cover_segment(cover_image, width, height, out_path, vb: str, maxrate: str, bufsize: str):
-    v = ffmpeg.input(cover_image, loop=1, framerate=FPS, t=COVER_DURATION)
+def make_cover_segment(cover_image, width, height, out_path, vb: str, maxrate: str, bufsize: str, threads=None):
+    v = ffmpeg.input(cover_image, loop=1, framerate=FPS, t=COVER_DURATION, **_thread_opts(threads))
     v = v.filter("scale", width, height, force_original_aspect_ratio="decrease") \
          .filter("pad", width, height, "(ow-iw)/2", "(oh-ih)/2") \
          .filter("setsar", 1) \
@@ -104,15 +142,32 @@ def make_cover_segment(cover_image, width, height, out_path, vb: str, maxrate: s
     out = ffmpeg.output(
         v, a, out_path,
         vcodec=ENCODER, acodec="aac", audio_bitrate=ABR,
-        pix_fmt="yuv420p", r=FPS, shortest=None, movflags="+faststart",
-        preset=PRESET, threads=THREADS if THREADS > 0 else None,
+        pix_fmt="yuv420p", r=FPS, shortest=None,
+        preset=PRESET, **_thread_opts(threads),
         **{"b:v": vb, "maxrate": maxrate, "bufsize": bufsize}
     )
-    _maybe_global(out).overwrite_output().run()
+    _maybe_global(out, threads).overwrite_output().run()
+
+
+def cover_segment(cover_image, width, height, out_path, vb: str, maxrate: str, bufsize: str, threads=None):
+    # make_cover_segment through the cover cache; the cached entry is hard linked (or copied) to out_path
+    if not USE_COVER_CACHE:
+        make_cover_segment(cover_image, width, height, out_path, vb, maxrate, bufsize, threads)
+        return out_path
+    with open(cover_image, "rb") as f:
+        image = f.read()
+    key = file_cache.make_key(
+        "asmr_cover", image, width, height, FPS, COVER_DURATION, ENCODER, PRESET, ABR, vb, maxrate, bufsize
+    )
+    cache = file_cache.FileCache(COVER_CACHE_DIR, COVER_CACHE_MAX_MB * 1024 * 1024, suffix=".mp4")
+    cached = cache.get_or_create(
+        key, lambda tmp_path: make_cover_segment(cover_image, width, height, tmp_path, vb, maxrate, bufsize, threads)
+    )
+    return file_cache.link_or_copy(cached, out_path)
 
 
-def make_forward_segment(src_path, width, height, out_path, has_audio, src_fps, a_rate, a_ch, a_codec, vb: str, maxrate: str, bufsize: str):
-    inp = ffmpeg.input(src_path)
+def make_forward_segment(src_path, width, height, out_path, has_audio, src_fps, a_rate, a_ch, a_codec, vb: str, maxrate: str, bufsize: str, duration=None, threads=None):
+    inp = ffmpeg.input(src_path, **_thread_opts(threads))
     v = inp.video.filter("setsar", 1).filter("format", "yuv420p")
     if not src_fps or abs(src_fps - FPS) > 0.01:
         v = v.filter("fps", FPS)
@@ -122,21 +177,41 @@ def make_forward_segment(src_path, width, height, out_path, has_audio, src_fps,
         acodec = 'aac'
     else:
         # create silence matching duration
-        _, _, duration, *_ = probe_video(src_path)
+        if duration is None:
+            _, _, duration, *_ = probe_video(src_path)
         a = ffmpeg.input("anullsrc=r=44100:cl=stereo", f="lavfi", t=duration).audio
         acodec = 'aac'
     out = ffmpeg.output(
         v, a, out_path,
         vcodec=ENCODER, acodec=acodec, audio_bitrate=ABR,
         pix_fmt="yuv420p", r=FPS,
-        preset=PRESET, threads=THREADS if THREADS > 0 else None, movflags="+faststart",
+        preset=PRESET, **_thread_opts(threads),
         **{"b:v": vb, "maxrate": maxrate, "bufsize": bufsize}
     )
-    _maybe_global(out).overwrite_output().run()
+    _maybe_global(out, threads).overwrite_output().run()
+
 
+def reverse_memory_mb(width, height, duration):
+    # Decoded frames the reverse filter holds for one unit encode (one chunk when reversing in chunks)
+    frames = min(math.ceil(duration * FPS), reverse_chunk_frames(width, height))
+    return frames * (width * height * 3 // 2) // (1024 * 1024)
 
-def make_reverse_segment(src_path, width, height, out_path, has_audio, src_fps, vb: str, maxrate: str, bufsize: str):
-    inp = ffmpeg.input(src_path)
+
+def reverse_chunk_frames(width, height):
+    if REVERSE_CHUNK_SECONDS > 0:
+        return max(1, int(REVERSE_CHUNK_SECONDS * FPS))
+    frame_bytes = width * height * 3 // 2  # decoded yuv420p frame
+    return max(1, REVERSE_MAX_MEMORY_MB * 1024 * 1024 // frame_bytes)
+
+
+def make_reverse_segment(src_path, width, height, out_path, has_audio, src_fps, vb: str, maxrate: str, bufsize: str, duration=None, threads=None):
+    if duration is None:
+        _, _, duration, *_ = probe_video(src_path)
+    chunk_frames = reverse_chunk_frames(width, height)
+    if duration * FPS > chunk_frames:
+        make_reverse_segment_chunked(src_path, out_path, has_audio, src_fps, duration, chunk_frames, vb, maxrate, bufsize, threads)
+        return
+    inp = ffmpeg.input(src_path, **_thread_opts(threads))
     v = inp.video.filter("setsar", 1).filter("format", "yuv420p")
     if not src_fps or abs(src_fps - FPS) > 0.01:
         v = v.filter("fps", FPS)
@@ -144,24 +219,268 @@ def make_reverse_segment(src_path, width, height, out_path, has_audio, src_fps,
     if has_audio:
         a = inp.audio.filter("atrim", start=0).filter("areverse").filter("aresample", 44100).filter("aformat", sample_fmts="fltp", channel_layouts="stereo")
     else:
-        _, _, duration, *_ = probe_video(src_path)
         a = ffmpeg.input("anullsrc=r=44100:cl=stereo", f="lavfi", t=duration).audio
     out = ffmpeg.output(
         v, a, out_path,
         vcodec=ENCODER, acodec='aac', audio_bitrate=ABR,
         pix_fmt="yuv420p", r=FPS,
-        preset=PRESET, threads=THREADS if THREADS > 0 else None, movflags="+faststart",
+        preset=PRESET, **_thread_opts(threads),
         **{"b:v": vb, "maxrate": maxrate, "bufsize": bufsize}
     )
-    _maybe_global(out).overwrite_output().run()
+    _maybe_global(out, threads).overwrite_output().run()
+
+
+def reverse_audio_streamed(src_path, out_path, scratch_dir):
+    # Decode the audio to raw PCM on disk, then feed it to the AAC encoder back to front one block at a time, so
+    # memory stays at one block however long the clip is and the reversed audio is one continuous encode
+    pcm_path = os.path.join(scratch_dir, "audio.f32")
+    (
+        ffmpeg.input(src_path).audio.filter("atrim", start=0)
+        .output(pcm_path, f="f32le", acodec="pcm_f32le", ac=2, ar=44100)
+        .overwrite_output().run()
+    )
+    frame_bytes = 8  # one stereo f32le frame, so reversing 8-byte items ("Q") reverses whole frames
+    encoder = (
+        ffmpeg.input("pipe:", f="f32le", ac=2, ar=44100)
+        .output(out_path, acodec="aac", audio_bitrate=ABR)
+        .overwrite_output().run_async(pipe_stdin=True)
+    )
+    try:
+        with open(pcm_path, "rb") as f:
+            pos = os.path.getsize(pcm_path) // frame_bytes * frame_bytes
+            while pos > 0:
+                size = min(pos, REVERSE_AUDIO_BLOCK_FRAMES * frame_bytes)
+                pos -= size
+                f.seek(pos)
+                block = array.array("Q", f.read(size))
+                block.reverse()
+                encoder.stdin.write(block.tobytes())
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+        os.remove(pcm_path)
+    if encoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to encode reversed audio for {src_path}")
+
+
+def make_reverse_segment_chunked(src_path, out_path, has_audio, src_fps, duration, chunk_frames, vb: str, maxrate: str, bufsize: str, threads=None):
+    # Video: each window of chunk_frames frames is seeked to, reversed and encoded on its own, so the reverse
+    # filter never holds more than one chunk. Audio is reversed on disk (reverse_audio_streamed) rather than
+    # per chunk, so there are no AAC priming gaps or clicks at chunk joins.
+    chunk_dir = out_path + ".chunks"
+    ensure_dir(chunk_dir)
+    try:
+        n_chunks = math.ceil(round(duration * FPS, 3) / chunk_frames)
+        print(f"Reversing {os.path.basename(src_path)} in {n_chunks} chunks of {chunk_frames} frames")
+        chunk_paths = []
+        for i in range(n_chunks):
+            start = i * chunk_frames / FPS
+            input_opts = dict(_thread_opts(threads), ss=start) if start else _thread_opts(threads)
+            inp = ffmpeg.input(src_path, **input_opts)
+            v = inp.video.filter("setsar", 1).filter("format", "yuv420p")
+            if not src_fps or abs(src_fps - FPS) > 0.01:
+                v = v.filter("fps", FPS)
+            v = v.filter("trim", end_frame=chunk_frames).filter("setpts", "PTS-STARTPTS").filter("reverse")
+            chunk_path = os.path.join(chunk_dir, f"{i:04d}.mp4")
+            out = ffmpeg.output(
+                v, chunk_path,
+                vcodec=ENCODER, pix_fmt="yuv420p", r=FPS,
+                preset=PRESET, **_thread_opts(threads),
+                **{"b:v": vb, "maxrate": maxrate, "bufsize": bufsize}
+            )
+            _maybe_global(out, threads).overwrite_output().run()
+            chunk_paths.append(chunk_path)
+
+        audio_path = os.path.join(chunk_dir, "audio.m4a")
+        if has_audio:
+            reverse_audio_streamed(src_path, audio_path, chunk_dir)
+        else:
+            a = ffmpeg.input("anullsrc=r=44100:cl=stereo", f="lavfi", t=duration).audio
+            ffmpeg.output(a, audio_path, acodec="aac", audio_bitrate=ABR).overwrite_output().run()
+
+        # Last chunk first: the reversed chunks in reverse order are the reversed clip
+        list_path = os.path.join(chunk_dir, "concat.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for p in reversed(chunk_paths):
+                f.write(f"file '{os.path.abspath(p)}'\n")
+        ffmpeg.output(
+            ffmpeg.input(list_path, f="concat", safe=0).video,
+            ffmpeg.input(audio_path).audio,
+            out_path,
+            vcodec="copy", acodec="copy"
+        ).overwrite_output().run()
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+def segment_span(path):
+    # (start, duration) of a temp segment's video (probed directly rather than through the shared probe cache).
+    # AAC priming/padding makes the container a little longer than the video, so joins are timed off the video.
+    info = media_probe.media_info_from_ffprobe(path, media_probe.run_ffprobe(path))
+    if not info.video_duration:
+        raise RuntimeError(f"cannot read duration of {path}")
+    start = float(info.video_stream.get("start_time") or 0.0)
+    return start, info.video_duration
+
+
+def write_playlist(list_path, entries):
+    # entries: [(path, (start, seconds))]. Every entry gets an inpoint/outpoint on its video, so the concat
+    # demuxer offsets the next entry by exactly that span: timestamps stay contiguous and monotonic across any
+    # number of entries.
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for path, (start, seconds) in entries:
+            f.write(f"file '{os.path.abspath(path)}'\ninpoint {start:.6f}\noutpoint {start + seconds:.6f}\n")
+
+
+def make_loop_unit(src_path, width, height, unit_path, has_audio, src_fps, duration, vb: str, maxrate: str, bufsize: str, threads=None):
+    # One forward+reverse palindrome that the output loops by stream copy
+    if duration * FPS > reverse_chunk_frames(width, height):
+        # Too long to reverse in memory: forward in its own pass and reverse in chunks, both at once with the
+        # threads split between them, then the halves are joined by stream copy
+        fwd_path = unit_path + ".fwd.mp4"
+        rev_path = unit_path + ".rev.mp4"
+        list_path = unit_path + ".txt"
+        threads = THREADS if threads is None else threads
+        fwd_threads = max(1, threads // 2) if threads > 0 else 0
+        rev_threads = max(1, threads - fwd_threads) if threads > 0 else 0
+        try:
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                fwd = pool.submit(make_forward_segment, src_path, width, height, fwd_path, has_audio, src_fps, None, None, None,
+                                  vb, maxrate, bufsize, duration=duration, threads=fwd_threads)
+                rev = pool.submit(make_reverse_segment, src_path, width, height, rev_path, has_audio, src_fps,
+                                  vb, maxrate, bufsize, duration=duration, threads=rev_threads)
+                fwd.result()
+                rev.result()
+            write_playlist(list_path, [(fwd_path, segment_span(fwd_path)), (rev_path, segment_span(rev_path))])
+            ffmpeg.output(
+                ffmpeg.input(list_path, f="concat", safe=0), unit_path,
+                vcodec="copy", acodec="copy"
+            ).overwrite_output().run()
+        finally:
+            for p in (fwd_path, rev_path, list_path):
+                if os.path.exists(p):
+                    os.remove(p)
+        return
+    # Otherwise forward and reverse come from one decode and are joined before encoding, so the unit has a
+    # single continuous audio track (no AAC padding at the turn-around point)
+    inp = ffmpeg.input(src_path, **_thread_opts(threads))
+    v = inp.video.filter("setsar", 1).filter("format", "yuv420p")
+    if not src_fps or abs(src_fps - FPS) > 0.01:
+        v = v.filter("fps", FPS)
+    if has_audio:
+        a = inp.audio.filter("aresample", 44100).filter("aformat", sample_fmts="fltp", channel_layouts="stereo")
+    else:
+        a = ffmpeg.input("anullsrc=r=44100:cl=stereo", f="lavfi", t=duration).audio
+    v_split = v.split()
+    a_split = a.asplit()
+    joined = ffmpeg.concat(v_split[0], a_split[0], v_split[1].filter("reverse"), a_split[1].filter("areverse"), v=1, a=1).node
+    out = ffmpeg.output(
+        joined[0], joined[1], unit_path,
+        vcodec=ENCODER, acodec="aac", audio_bitrate=ABR,
+        pix_fmt="yuv420p", r=FPS,
+        preset=PRESET, **_thread_opts(threads),
+        **{"b:v": vb, "maxrate": maxrate, "bufsize": bufsize}
+    )
+    _maybe_global(out, threads).overwrite_output().run()
+
+
+def loop_entries(cover_path, unit_path, total_seconds):
+    # Cover once, then the unit as many times as needed; the last entry is cut so the output ends on
+    # total_seconds (just the cut cover when it is at least that long)
+    cover_span = segment_span(cover_path)
+    unit_start, unit_seconds = unit_span = segment_span(unit_path)
+    remaining = total_seconds - cover_span[1]
+    if round(remaining, 6) <= 0:
+        # The cover alone fills the output
+        return [(cover_path, (cover_span[0], total_seconds))]
+    repeats = max(1, math.ceil(round(remaining / unit_seconds, 6)))
+    entries = [(cover_path, cover_span)] + [(unit_path, unit_span)] * (repeats - 1)
+    entries.append((unit_path, (unit_start, remaining - (repeats - 1) * unit_seconds)))
+    return entries
+
+
+def write_loop_playlist(list_path, cover_path, unit_path, total_seconds):
+    entries = loop_entries(cover_path, unit_path, total_seconds)
+    write_playlist(list_path, entries)
+    return len(entries) - 1
+
+
+def segment_packets(path):
+    # [(codec_type, pts seconds, bytes)] for every packet of a temp segment
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "packet=codec_type,pts_time,size", "-of", "csv=p=0", path],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {result.stderr.strip()}")
+    packets = []
+    for line in result.stdout.splitlines():
+        parts = line.split(",")
+        if len(parts) >= 3 and parts[1] not in ("", "N/A"):
+            packets.append((parts[0], float(parts[1]), int(parts[2])))
+    return packets
+
+
+def predict_output_size(cover_path, unit_path, total_seconds):
+    # Exact payload of the concat output (the packets each playlist entry lets through), split into
+    # (video bytes, other bytes), plus an upper estimate of the container index
+    packets = {}
+    video = other = 0
+    for path, (start, seconds) in loop_entries(cover_path, unit_path, total_seconds):
+        if path not in packets:
+            packets[path] = segment_packets(path)
+        for codec_type, pts, size in packets[path]:
+            if pts < start + seconds:
+                if codec_type == "video":
+                    video += size
+                else:
+                    other += size
+    return video, other + mp4_output.reserved_moov_size(total_seconds, FPS)
+
+
+def plan_unit_bitrate(cover_path, unit_path, targets, vb: str, remake_unit):
+    # Re-encode the unit (remake_unit(vb, maxrate, bufsize)) until every target's predicted output is under its
+    # cap and the tightest one is at least PLAN_MIN_FILL of its cap. targets: [(total seconds, max GB)]. The
+    # cover is a couple of seconds at most, so it is left as is. Returns the predicted sizes in bytes.
+    video_bps = _parse_abr_to_bps(vb)
+    last_video = None
+    for attempt in range(PLAN_MAX_PASSES + 1):
+        predictions = []
+        for total_seconds, max_gb in targets:
+            video, other = predict_output_size(cover_path, unit_path, total_seconds)
+            predictions.append((video, other, max_gb * (1024 ** 3)))
+            print(f"Predicted {total_seconds / 60:g} min output {(video + other) / 1024 ** 3:.3f} GB "
+                  f"at {video_bps // 1000}k (cap {max_gb} GB)")
+        fill = max((video + other) / cap for video, other, cap in predictions)
+        video = min(p[0] for p in predictions)
+        if PLAN_MIN_FILL <= fill <= 1 or attempt == PLAN_MAX_PASSES or video <= 0:
+            break
+        if last_video is not None and fill < 1 and video < last_video * 1.05:
+            # A higher bitrate barely grew the unit: simple content is already at full quality
+            break
+        last_video = video
+        # Video bytes scale with the video bitrate; audio and the index don't
+        new_bps = max(min(int(video_bps * (cap * SIZE_SAFETY - other) / v) for v, other, cap in predictions), MIN_VIDEO_BPS)
+        if new_bps == video_bps:
+            break
+        video_bps = new_bps
+        print(f"Re-encoding loop unit at {video_bps // 1000}k")
+        remake_unit(*bitrate_args(video_bps))
+    for (total_seconds, max_gb), (video, other, cap) in zip(targets, predictions):
+        if video + other > cap:
+            print(f"Warning: predicted {total_seconds / 60:g} min output {(video + other) / 1024 ** 3:.3f} GB "
+                  f"is over the {max_gb} GB cap")
+    return [video + other for video, other, _ in predictions]
 
 
 def concat_segments(list_file, out_path, total_seconds=None):
     inp = ffmpeg.input(list_file, f="concat", safe=0)
-    # Re-mux only (no re-encode) for minimal CPU; segments were already normalized
-    out_kwargs = dict(vcodec="copy", acodec="copy", movflags="+faststart")
+    # Re-mux only (no re-encode) for minimal CPU; segments were already normalized. Segments are only read
+    # back by ffmpeg so they keep moov at the end; the final file gets the MP4_OUTPUT_MODE layout.
+    out_kwargs = dict(vcodec="copy", acodec="copy", **mp4_output.output_args(duration=total_seconds, fps=FPS))
     if total_seconds:
-        out_kwargs["t"] = int(total_seconds)
+        out_kwargs["t"] = total_seconds
     (
         ffmpeg.output(inp, out_path, **out_kwargs).overwrite_output().run()
     )
@@ -171,71 +490,131 @@ def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 
-def main():
-    ensure_dir(OUTPUT_FOLDER)
-    raw_videos = [f for f in os.listdir(RAW_FOLDER) if f.lower().endswith((".mp4", ".mov", ".avi", ".mkv"))]
-    if not raw_videos:
-        raise ValueError("No videos found in raw_asmr folder!")
+def default_memory_budget_mb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (2 * 1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+
+class StageBudget:
+    # ffmpeg threads and reverse-filter memory shared by every ffmpeg stage in flight. reserve() blocks until
+    # the stage's share is free; a request larger than the whole budget is clamped to it so it can still run.
+    def __init__(self, threads, memory_mb):
+        self.threads = threads
+        self.memory_mb = memory_mb
+        self._threads_used = 0
+        self._memory_used = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, threads, memory_mb=0):
+        threads = max(1, min(threads, self.threads))
+        memory_mb = min(memory_mb, self.memory_mb)
+        with self._cond:
+            self._cond.wait_for(lambda: self._threads_used + threads <= self.threads
+                                and self._memory_used + memory_mb <= self.memory_mb)
+            self._threads_used += threads
+            self._memory_used += memory_mb
+        try:
+            yield threads
+        finally:
+            with self._cond:
+                self._threads_used -= threads
+                self._memory_used -= memory_mb
+                self._cond.notify_all()
+
+
+def process_video(video, targets, budget):
+    src = os.path.abspath(os.path.join(RAW_FOLDER, video))
+    base = os.path.splitext(os.path.basename(video))[0]
 
-    for video in raw_videos:
-        src = os.path.abspath(os.path.join(RAW_FOLDER, video))
-        base = os.path.splitext(os.path.basename(video))[0]
-        out_final = os.path.abspath(os.path.join(OUTPUT_FOLDER, f"asmr_{video}"))
-        tmp_dir = os.path.abspath(os.path.join(OUTPUT_FOLDER, f"tmp_{base}"))
-        ensure_dir(tmp_dir)
+    try:
+        width, height, duration, has_audio, src_fps, a_rate, a_ch, a_codec = probe_video(src)
+    except Exception as e:
+        print(f"Skipping {video}: probe failed ({e})")
+        return
+
+    # Unique per job: videos in flight together can share a stem (clip.mp4, clip.mov)
+    ensure_dir(OUTPUT_FOLDER)
+    tmp_dir = tempfile.mkdtemp(prefix=f"tmp_{base}_", dir=os.path.abspath(OUTPUT_FOLDER))
+    try:
+        _build_outputs(video, src, tmp_dir, targets, budget, width, height, duration, has_audio, src_fps)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
+    if DELETE_OLD_VIDEOS:
         try:
-            width, height, duration, has_audio, src_fps, a_rate, a_ch, a_codec = probe_video(src)
+            os.remove(src)
+            print(f"Deleted {src}")
         except Exception as e:
-            print(f"Skipping {video}: probe failed ({e})")
-            continue
-
-        cover_seg = os.path.join(tmp_dir, "000_cover.mp4")
-        fwd_seg = os.path.join(tmp_dir, "001_forward.mp4")
-        rev_seg = os.path.join(tmp_dir, "002_reverse.mp4")
-
-        # Compute bitrate budget to keep final under cap
-        total_seconds = TOTAL_MINUTES * 60
-        audio_bps = _parse_abr_to_bps(ABR)
-        vb, maxrate, bufsize = compute_bitrate_budget(total_seconds, audio_bps)
-
-        # Build segments at target bitrate
-        make_cover_segment(COVER_IMAGE, width, height, cover_seg, vb, maxrate, bufsize)
-        make_forward_segment(src, width, height, fwd_seg, has_audio, src_fps, a_rate, a_ch, a_codec, vb, maxrate, bufsize)
-        make_reverse_segment(src, width, height, rev_seg, has_audio, src_fps, vb, maxrate, bufsize)
-
-        # Build concat list
-        playlist = [cover_seg]
-        current = COVER_DURATION
-        while current < total_seconds + duration:  # slightly overbuild for safety
-            playlist.append(fwd_seg)
-            current += duration
-            playlist.append(rev_seg)
-            current += duration
-
-        list_path = os.path.join(tmp_dir, "concat.txt")
-        with open(list_path, "w", encoding="utf-8") as f:
-            for p in playlist:
-                f.write(f"file '{os.path.abspath(p)}'\n")
+            print(f"Error deleting {src}: {e}")
+
+
+def _build_outputs(video, src, tmp_dir, targets, budget, width, height, duration, has_audio, src_fps):
+    cover_seg = os.path.join(tmp_dir, "000_cover.mp4")
+    unit_seg = os.path.join(tmp_dir, "001_unit.mp4")
+
+    # Compute bitrate budget to keep every output under its cap: the segments are shared, so the
+    # target with the least bytes per second sets the bitrate
+    audio_bps = _parse_abr_to_bps(ABR)
+    seconds_targets = [(minutes * 60, max_gb) for minutes, max_gb in targets]
+    vb, maxrate, bufsize = min(
+        (compute_bitrate_budget(total_seconds, audio_bps, max_gb) for total_seconds, max_gb in seconds_targets),
+        key=lambda rates: _parse_abr_to_bps(rates[0]),
+    )
+
+    # Thread shares: each video in flight gets an equal slice of the budget for its unit encode
+    unit_threads = max(1, budget.threads // PIPELINE_VIDEOS)
+    unit_memory = reverse_memory_mb(width, height, duration)
+
+    def encode_cover():
+        with budget.reserve(min(2, unit_threads)) as threads:
+            cover_segment(COVER_IMAGE, width, height, cover_seg, vb, maxrate, bufsize, threads)
+
+    def encode_unit(vb, maxrate, bufsize):
+        with budget.reserve(unit_threads, unit_memory) as threads:
+            make_loop_unit(src, width, height, unit_seg, has_audio, src_fps, duration, vb, maxrate, bufsize, threads)
+
+    # Build segments at target bitrate, cover and unit at the same time
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        cover_done = pool.submit(encode_cover)
+        encode_unit(vb, maxrate, bufsize)
+        cover_done.result()
+    if PLAN_OUTPUT_SIZE:
+        plan_unit_bitrate(cover_seg, unit_seg, seconds_targets, vb, encode_unit)
+
+    for minutes, _ in targets:
+        total_seconds = minutes * 60
+        name = f"asmr_{video}" if len(targets) == 1 else f"asmr_{minutes:g}min_{video}"
+        out_final = os.path.abspath(os.path.join(OUTPUT_FOLDER, name))
+
+        # Loop the unit behind the cover
+        list_path = os.path.join(tmp_dir, f"concat_{minutes:g}.txt")
+        write_loop_playlist(list_path, cover_seg, unit_seg, total_seconds)
 
         # Concat and trim to target duration in one pass
         concat_segments(list_path, out_final, total_seconds=total_seconds)
         print(f"Exported {out_final}")
 
-        # Cleanup temp dir
-        try:
-            for fn in os.listdir(tmp_dir):
-                os.remove(os.path.join(tmp_dir, fn))
-            os.rmdir(tmp_dir)
-        except Exception:
-            pass
-
-        if DELETE_OLD_VIDEOS:
-            try:
-                os.remove(src)
-                print(f"Deleted {src}")
-            except Exception as e:
-                print(f"Error deleting {src}: {e}")
+
+def main(targets=None):
+    # targets: [(minutes, max size GB)], defaults to TARGETS
+    targets = [(float(minutes), float(max_gb)) for minutes, max_gb in (targets or TARGETS)]
+    if not targets:
+        raise ValueError("No output targets given!")
+    ensure_dir(OUTPUT_FOLDER)
+    raw_videos = [f for f in os.listdir(RAW_FOLDER) if f.lower().endswith((".mp4", ".mov", ".avi", ".mkv"))]
+    if not raw_videos:
+        raise ValueError("No videos found in raw_asmr folder!")
+    media_probe.probe_many([os.path.abspath(os.path.join(RAW_FOLDER, v)) for v in raw_videos])
+
+    budget = StageBudget(THREAD_BUDGET, MEMORY_BUDGET_MB or default_memory_budget_mb())
+    print(f"Budget: {budget.threads} threads, {budget.memory_mb} MB reverse memory, {PIPELINE_VIDEOS} videos in flight")
+    with ThreadPoolExecutor(max_workers=max(1, PIPELINE_VIDEOS)) as pool:
+        jobs = [pool.submit(process_video, video, targets, budget) for video in raw_videos]
+        for job in jobs:
+            job.result()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,12 @@
+import math
 import os
 import ffmpeg
-import cv2
-import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import random
-import subprocess
+import shutil
+import tempfile
+import media_probe
+import mp4_output
 try:
     from tqdm import tqdm
 except ImportError:
@@ -22,6 +24,10 @@ FPS = 30
 CRF = 20
 ABR = "192k"
 VIDEO_SPEED = 0.8  # 1.0 = normal, 0.8 = 20% slower, 2.0 = 2x speed
+PHOTO_SECONDS = 3  # how long each coding_photos image is shown before the main video
+# Without photos and with audio longer than two passes of the clip, encode the speed-adjusted clip once and
+# repeat it by stream copy instead of re-encoding every looped frame (encode cost ~ clip length, not audio length)
+LOOP_UNIT_MODE = True
 
 
 # Deletion settings
@@ -39,15 +45,8 @@ def list_media(dir_path, exts):
 
 
 def probe_duration(path):
-	p = ffmpeg.probe(path)
-	dur = p.get("format", {}).get("duration")
-	if dur:
-		return float(dur)
-	# Fallback: try first stream duration
-	for s in p.get("streams", []):
-		if s.get("duration"):
-			return float(s["duration"])
-	return None
+	# Container duration, falling back to the first stream that reports one
+	return media_probe.probe(path).duration
 
 
 def find_matching_video(audio_name, videos):
@@ -81,94 +80,145 @@ def mux_looped(video_path, audio_path, output_path, audio_seconds):
 	photo_paths = [os.path.join(photos_dir, f) for f in photo_files]
 	used_photos = list(photo_paths)
 
+	# Probe main video for size
+	try:
+		info = media_probe.probe(video_path)
+		width, height = info.width, info.height
+		clip_seconds = info.video_duration
+	except Exception:
+		width, height = 1280, 720
+		clip_seconds = None
+	if not width or not height:
+		width, height = 1280, 720
+
+	# Pre-render the title once; it is overlaid inside the final encode instead of a separate OpenCV pass
+	tmpdir = tempfile.mkdtemp(prefix="coding_mux_")
+	title = os.path.splitext(os.path.basename(output_path))[0]
+	title_png = render_title_png(title, width, height, os.path.join(tmpdir, "title.png"))
+	try:
+		looped = (LOOP_UNIT_MODE and not photo_paths and clip_seconds and clip_seconds / spd > 2 * OVERLAY_SECONDS
+				and audio_seconds > 2 * clip_seconds / spd
+				and _mux_loop_unit(video_path, a_in, output_path, audio_seconds, spd, tmpdir, title_png))
+		if not looped:
+			_mux_streams(v_stream, a_in, output_path, audio_seconds, photo_paths, width, height, title_png)
+	finally:
+		shutil.rmtree(tmpdir, ignore_errors=True)
+
+	# Optionally delete used photos
+	if photo_paths and DELETE_PHOTOS_AFTER:
+		for p in used_photos:
+			try:
+				os.remove(p)
+				print(f"Deleted photo: {os.path.basename(p)}")
+			except Exception as de:
+				print(f"Could not delete photo {p}: {de}")
+
+
+def _with_title(v_stream, title_png):
+	return ffmpeg.overlay(v_stream, ffmpeg.input(title_png), enable=f"lt(t,{OVERLAY_SECONDS})")
+
+
+def _speed_adjusted(video_path, spd):
+	v = ffmpeg.input(video_path).video
+	if abs(spd - 1.0) > 1e-6:
+		v = v.filter('setpts', f'PTS/{spd}')
+	return v
+
+
+def _mux_loop_unit(video_path, a_in, output_path, audio_seconds, spd, tmpdir, title_png):
+	# Encode the speed-adjusted clip once at the output settings and repeat it with the concat demuxer and
+	# stream copy. The title only needs the first OVERLAY_SECONDS, so the same decode also encodes a short
+	# titled head, and the unit gets a keyframe where the head ends: the first pass is the head followed by the
+	# unit from that keyframe. A short encoded tail takes the video to the exact audio length, so the end never
+	# cuts into a GOP. Only the audio is encoded in full. Returns False, without writing output_path, when the
+	# encoded unit can't be measured, so the caller encodes the full length instead.
+	encode_args = dict(vcodec="libx264", r=FPS, pix_fmt="yuv420p", crf=CRF, preset="medium")
+	head_seconds = math.ceil(OVERLAY_SECONDS * FPS) / FPS
+	print("Encoding loop unit...")
+	titled_head = os.path.join(tmpdir, "head_titled.mp4")
+	plain_unit = os.path.join(tmpdir, "unit.mp4")
+	unit = _speed_adjusted(video_path, spd).split()
+	ffmpeg.merge_outputs(
+		ffmpeg.output(_with_title(unit[0], title_png), titled_head, t=head_seconds, **encode_args),
+		ffmpeg.output(unit[1], plain_unit, force_key_frames=f"{head_seconds:.6f}", **encode_args),
+	).overwrite_output().run()
+
+	# Temp file, so probe it directly rather than through the shared cache
+	try:
+		unit_seconds = media_probe.media_info_from_ffprobe(plain_unit, media_probe.run_ffprobe(plain_unit)).video_duration
+	except media_probe.ProbeError as e:
+		print(f"Could not probe the loop unit ({e}), encoding the full length instead")
+		return False
+	if not unit_seconds or unit_seconds <= head_seconds:
+		print(f"Loop unit has no usable duration ({unit_seconds}), encoding the full length instead")
+		return False
+	repeats = max(1, int(audio_seconds // unit_seconds))
+	entries = [(titled_head, None), (plain_unit, head_seconds)] + [(plain_unit, None)] * (repeats - 1)
+	tail_frames = int(round((audio_seconds - repeats * unit_seconds) * FPS))
+	if tail_frames > 0:
+		tail = os.path.join(tmpdir, "tail.mp4")
+		ffmpeg.output(_speed_adjusted(video_path, spd), tail, t=tail_frames / FPS, **encode_args).overwrite_output().run()
+		entries.append((tail, None))
+
+	loop_list = os.path.join(tmpdir, "loop.txt")
+	with open(loop_list, "w", encoding="utf-8") as f:
+		f.write("ffconcat version 1.0\n")
+		for seg, inpoint in entries:
+			f.write(f"file '{seg}'\n")
+			if inpoint:
+				f.write(f"inpoint {inpoint:.6f}\n")
+
+	print(f"Muxing video ({repeats} x {unit_seconds:.2f}s unit + {tail_frames} frame tail) and audio...")
+	ffmpeg.output(
+		ffmpeg.input(loop_list, f="concat", safe=0).video,
+		a_in.audio,
+		output_path,
+		vcodec="copy", acodec="aac", audio_bitrate=ABR,
+		t=audio_seconds, **mp4_output.output_args(duration=audio_seconds, fps=FPS)
+	).overwrite_output().run()
+	return True
+
+
+def _mux_streams(v_stream, a_in, output_path, audio_seconds, photo_paths, width, height, title_png):
 	if photo_paths:
-		print("Creating photo segments...")
-		# Probe main video for size
-		try:
-			probe = ffmpeg.probe(video_path)
-			vstreams = [s for s in probe["streams"] if s["codec_type"] == "video"]
-			width = int(vstreams[0]["width"])
-			height = int(vstreams[0]["height"])
-		except Exception:
-			width, height = 1280, 720
-
-		# Create temp folder for photo segments
-		import tempfile
-		tmpdir = tempfile.mkdtemp(prefix="coding_photo_segs_")
-		seg_paths = []
-		for idx, p in enumerate(photo_paths):
-			seg_out = os.path.join(tmpdir, f"photo_{idx:03d}.mp4")
-			v = ffmpeg.input(p, loop=1, framerate=FPS, t=3)
+		print("Building photo + main video graph...")
+		# Photo stills, then the looped main video, joined by the concat filter and encoded once with the audio
+		segments = []
+		for p in photo_paths:
+			v = ffmpeg.input(p, loop=1, framerate=FPS, t=PHOTO_SECONDS)
 			v = v.filter("scale", width, height, force_original_aspect_ratio="decrease") \
 				 .filter("pad", width, height, "(ow-iw)/2", "(oh-ih)/2") \
 				 .filter("setsar", 1) \
 				 .filter("fps", FPS) \
 				 .filter("format", "yuv420p")
-			out = ffmpeg.output(
-				v, seg_out,
-				vcodec="libx264",
-				r=FPS, pix_fmt="yuv420p", crf=CRF, preset="medium", movflags="+faststart"
-			)
-			out.overwrite_output().run()
-			seg_paths.append(seg_out)
-
-		print("Creating main video segment...")
-		# Build concat list: main video (trimmed), then photo segments (video only)
-		import shutil
-		main_seg = os.path.join(tmpdir, "main.mp4")
-		ffmpeg.output(
-			v_stream, main_seg,
-			vcodec="libx264",
-			r=FPS, pix_fmt="yuv420p", crf=CRF, preset="medium",
-			t=audio_seconds - len(seg_paths)*3, movflags="+faststart"
-		).overwrite_output().run()
-
-		print("Concatenating segments...")
-		concat_list = os.path.join(tmpdir, "concat.txt")
-		with open(concat_list, "w", encoding="utf-8") as f:
-			for seg in seg_paths:
-				f.write(f"file '{seg}'\n")
-			f.write(f"file '{main_seg}'\n")
-
-		# Final concat (video only), then overlay audio and trim to audio duration
-		concat_vid = os.path.join(tmpdir, "concat_final.mp4")
-		ffmpeg.output(
-			ffmpeg.input(concat_list, f="concat", safe=0),
-			concat_vid,
-			vcodec="libx264", r=FPS, pix_fmt="yuv420p", crf=CRF, preset="medium", movflags="+faststart"
-		).overwrite_output().run()
+			segments.append(v)
+		main_seconds = audio_seconds - len(photo_paths) * PHOTO_SECONDS
+		if main_seconds > 0:
+			main = v_stream.filter("fps", FPS) \
+				.filter("scale", width, height) \
+				.filter("setsar", 1) \
+				.filter("format", "yuv420p") \
+				.filter("trim", duration=main_seconds) \
+				.filter("setpts", "PTS-STARTPTS")
+			segments.append(main)
+		v_out = ffmpeg.concat(*segments, v=1, a=0) if len(segments) > 1 else segments[0]
 
-		print("Muxing audio...")
+		print("Muxing video and audio...")
 		ffmpeg.output(
-			ffmpeg.input(concat_vid),
+			_with_title(v_out, title_png),
 			a_in,
 			output_path,
 			vcodec="libx264", acodec="aac", audio_bitrate=ABR,
 			r=FPS, pix_fmt="yuv420p", crf=CRF, preset="medium",
-			t=audio_seconds, movflags="+faststart"
+			t=audio_seconds, **mp4_output.output_args(duration=audio_seconds, fps=FPS)
 		).overwrite_output().run()
-
-		# Apply thumbnail overlay
-		title = os.path.splitext(os.path.basename(output_path))[0]
-		apply_thumbnail_overlay(output_path, title)
-
-		# Cleanup temp files
-		shutil.rmtree(tmpdir, ignore_errors=True)
-		# Optionally delete used photos
-		if DELETE_PHOTOS_AFTER:
-			for p in used_photos:
-				try:
-					os.remove(p)
-					print(f"Deleted photo: {os.path.basename(p)}")
-				except Exception as de:
-					print(f"Could not delete photo {p}: {de}")
 	else:
 		print("Muxing video and audio...")
 		# No photos: normal mux
 		(
 			ffmpeg
 			.output(
-				v_stream,
+				_with_title(v_stream, title_png),
 				a_in,
 				output_path,
 				vcodec="libx264",
@@ -179,18 +229,15 @@ def mux_looped(video_path, audio_path, output_path, audio_seconds):
 				crf=CRF,
 				preset="medium",
 				t=audio_seconds,
-				movflags="+faststart",
+				**mp4_output.output_args(duration=audio_seconds, fps=FPS),
 			)
 			.overwrite_output()
 			.run()
 		)
 
-		# Apply thumbnail overlay
-		title = os.path.splitext(os.path.basename(output_path))[0]
-		apply_thumbnail_overlay(output_path, title)
-
 # Thumbnail overlay settings
 FONT_SIZE = 300
+OVERLAY_SECONDS = 0.5  # how long the title stays on screen
 
 # 6 different neon colors
 NEON_COLORS = [
@@ -214,20 +261,20 @@ except:
         FONT_PATH = None
         font = ImageFont.load_default()
 
-def has_audio(filepath):
-    try:
-        result = subprocess.run(['ffprobe', '-i', filepath, '-show_streams', '-select_streams', 'a', '-loglevel', 'error'], capture_output=True, text=True)
-        return result.returncode == 0 and 'codec_type=audio' in result.stdout
-    except:
-        return False
+def _composite(layer, im, x, y):
+    # alpha_composite rejects negative offsets, so crop off whatever hangs past the top/left edge
+    sx, sy = max(0, -x), max(0, -y)
+    if sx >= im.width or sy >= im.height:
+        return
+    layer.alpha_composite(im, dest=(max(0, x), max(0, y)), source=(sx, sy))
 
-def add_neon_text(frame, text, font, color):
-    # Convert frame to PIL Image
-    img_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(img_pil)
+def _render_neon_layer(text, font, color, width, height):
+    # Draw the title onto a transparent frame-sized RGBA layer
+    layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
     
     # Text wrapping
-    max_width = img_pil.width - 100  # margin
+    max_width = width - 100  # margin
     words = text.split()
     lines = []
     current_line = ""
@@ -245,6 +292,8 @@ def add_neon_text(frame, text, font, color):
             current_line = test_line
     if current_line:
         lines.append(current_line)
+    if not lines:
+        return layer
     
     # Angle for text
     angle = 10  # slight right tilt upward
@@ -294,86 +343,26 @@ def add_neon_text(frame, text, font, color):
     
     # Position lines
     total_height = sum(img.height for img in text_images) + (len(text_images) - 1) * 5
-    y_start = max(50, (img_pil.height - total_height) // 5)  # Ensure minimum margin from top
-    x_center = img_pil.width // 2
+    y_start = max(50, (height - total_height) // 5)  # Ensure minimum margin from top
+    x_center = width // 2
     
     # Draw semi-transparent black background covering the whole screen
-    bg_overlay = Image.new('RGBA', (img_pil.width, img_pil.height), (0, 0, 0, 120))  # Semi-transparent black
-    img_pil.paste(bg_overlay, (0, 0), bg_overlay)
+    bg_overlay = Image.new('RGBA', (width, height), (0, 0, 0, 120))  # Semi-transparent black
+    layer.alpha_composite(bg_overlay)
     
     current_y = y_start
     for rotated in text_images:
         x = x_center - rotated.width // 2
-        img_pil.paste(rotated, (x, current_y), rotated)
+        _composite(layer, rotated, x, current_y)
         current_y += rotated.height + 5
     
-    # Convert back to OpenCV frame
-    return cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
+    return layer
 
-def apply_thumbnail_overlay(video_path, title_text):
-    # Select a random neon color for this video
+def render_title_png(title_text, width, height, out_path):
+    # Render the title for a random neon color as a transparent PNG at the video's resolution
     random_color = random.choice(NEON_COLORS)
-    
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video: {video_path}")
-        return
-    
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frames_to_modify = int(0.5 * fps)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    
-    # Create temp output
-    temp_output = video_path + '.temp.mp4'
-    out = cv2.VideoWriter(temp_output, fourcc, fps, (width, height))
-
-    frame_count = 0
-    if tqdm:
-        with tqdm(total=frames_to_modify, desc="Applying thumbnail") as pbar:
-            while frame_count < frames_to_modify:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                frame = add_neon_text(frame, title_text, font, random_color)
-                out.write(frame)
-                frame_count += 1
-                pbar.update(1)
-    else:
-        while frame_count < frames_to_modify:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frame = add_neon_text(frame, title_text, font, random_color)
-            out.write(frame)
-            frame_count += 1
-    
-    # Process remaining frames without modification
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        out.write(frame)
-
-    cap.release()
-    out.release()
-    
-    # Preserve audio by muxing with original if it has audio
-    if has_audio(video_path):
-        try:
-            temp_final = video_path + '.final.mp4'
-            result = subprocess.run(['ffmpeg', '-i', temp_output, '-i', video_path, '-c', 'copy', '-map', '0:v', '-map', '1:a', '-y', temp_final], check=True, capture_output=True, text=True)
-            os.replace(temp_final, video_path)
-            os.remove(temp_output)  # Remove the temp video without audio
-            print(f"Thumbnail applied and audio preserved for: {os.path.basename(video_path)}")
-        except subprocess.CalledProcessError as e:
-            print(f"Warning: Could not preserve audio for {os.path.basename(video_path)}")
-            # Fallback: just replace with temp_output
-            os.replace(temp_output, video_path)
-    else:
-        os.replace(temp_output, video_path)
-        print(f"Thumbnail applied for: {os.path.basename(video_path)}")
+    _render_neon_layer(title_text, font, random_color, width, height).save(out_path)
+    return out_path
 
 def main():
 	ensure_dirs()
@@ -388,6 +377,7 @@ def main():
 	# Use absolute paths
 	audio_paths = [os.path.join(AUDIO_DIR, f) for f in audio_files]
 	video_paths = [os.path.join(VIDEO_DIR, f) for f in video_files]
+	media_probe.probe_many(audio_paths + video_paths)
 
 	successes = []  # (audio_path, video_path, base_matched)
 	if tqdm:
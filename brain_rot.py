@@ -1,6 +1,11 @@
 import os
 import random
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 import ffmpeg
+import media_probe
+import mp4_output
 
 # ========================== USER SETTINGS (edit here) ==========================
 # General encoding & performance
@@ -38,12 +43,37 @@ BASE_VOLUME_PERCENT = max(0, min(1000, BASE_VOLUME_PERCENT))
 ORIGINAL_VOLUME_PERCENT = max(0, min(1000, ORIGINAL_VOLUME_PERCENT))
 NEW_VOLUME_PERCENT = max(0, min(1000, NEW_VOLUME_PERCENT))
 
+# Batch parallelism: BATCH_JOBS shorts render at once and split TOTAL_THREADS ffmpeg threads between them.
+# BATCH_JOBS=0 picks as many THREADS-sized jobs as fit in TOTAL_THREADS.
+try:
+    BATCH_JOBS = int(os.environ.get('BATCH_JOBS', '0'))
+except Exception:
+    BATCH_JOBS = 0
+try:
+    TOTAL_THREADS = int(os.environ.get('TOTAL_THREADS', str(os.cpu_count() or THREADS)))
+except Exception:
+    TOTAL_THREADS = os.cpu_count() or THREADS
+
+# Write the framed top/bottom halves to their own files as well (one extra encode each; debugging only)
+DEBUG_INTERMEDIATES = os.environ.get('DEBUG_INTERMEDIATES', '0').strip() not in ('0', 'false', 'no')
+
 # Input/Output folders
 raw_short_folder = "raw_short"          # Main/top video input folder
 brainrot_folder = "brainrot_videos"     # Background/bottom video folder
 output_folder = "ready_short"           # Output folder
 audio_folder = os.environ.get('AUDIO_FOLDER', 'short_audio')  # Where to pull background audio files from
 
+# Background library cache: each brainrot clip is normalized once into a 1080x960@FPS short-GOP mezzanine
+# and every short seeks to a random window of it. Entries are keyed by the source's content hash plus
+# these settings, so editing a clip or changing a setting rebuilds it.
+USE_BACKGROUND_CACHE = os.environ.get('USE_BACKGROUND_CACHE', '1').strip() not in ('0', 'false', 'no')
+BACKGROUND_CACHE_DIR = os.environ.get('BACKGROUND_CACHE_DIR', os.path.join(brainrot_folder, '.mezzanine'))
+try:
+    MEZZANINE_GOP = int(os.environ.get('MEZZANINE_GOP', '30'))  # keyframe interval in frames (1 = all-intra)
+except Exception:
+    MEZZANINE_GOP = 30
+MEZZANINE_CRF = 16          # mezzanine quality; kept well above CRF since it is encoded again per short
+
 # Top panel framing (1080x960 area)
 # MAIN_FILL_MODE: 'pad' keeps the entire frame; 'fill' zooms & crops to fill the area.
 MAIN_FILL_MODE = os.environ.get('MAIN_FILL_MODE', 'fill').lower()  # 'pad' or 'fill'
@@ -92,123 +122,126 @@ if 'NEW_AUDIO_VOLUME' not in os.environ:
     NEW_AUDIO_VOLUME = max(0.0, min(10.0, base_mult * (NEW_VOLUME_PERCENT / 100.0)))
 # ==============================================================================
 
-os.makedirs(output_folder, exist_ok=True)
 
-brainrot_videos = [f for f in os.listdir(brainrot_folder) if f.endswith((".mp4", ".mov", ".avi", ".mkv"))]
-if not brainrot_videos:
-    raise ValueError("No videos found in brainrot folder!")
+STACK_W, STACK_H = 1080, 1920  # output canvas; each half is STACK_W x STACK_H/2
+BRAINROT_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+RAW_SHORT_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".MOV")
 
-raw_short_videos = [f for f in os.listdir(raw_short_folder) if f.endswith((".mp4", ".mov", ".avi", ".mkv", ".MOV"))]
-if not raw_short_videos:
-    raise ValueError("No videos found in raw_short folder!")
+def default_settings(**overrides):
+    # Per-short settings; build_short/run_batch take this dict so workers don't rely on module globals
+    settings = {
+        'output_folder': output_folder,
+        'fps': FPS,
+        'crf': CRF,
+        'threads': THREADS,
+        'main_fill_mode': MAIN_FILL_MODE,
+        'main_zoom_percent': MAIN_ZOOM_PERCENT,
+        'keep_original_audio': KEEP_ORIGINAL_AUDIO,
+        'original_audio_volume': ORIGINAL_AUDIO_VOLUME,
+        'new_audio_volume': NEW_AUDIO_VOLUME,
+        'use_background_cache': USE_BACKGROUND_CACHE,
+        'debug_intermediates': DEBUG_INTERMEDIATES,
+        'delete_old_videos': DELETE_OLD_VIDEOS,
+    }
+    settings.update(overrides)
+    return settings
 
 def get_video_info(path):
-    probe = ffmpeg.probe(path)
-    video_streams = [s for s in probe['streams'] if s['codec_type'] == 'video']
-    if not video_streams:
+    info = media_probe.probe(path)
+    if not info.has_video:
         raise ValueError(f"No video stream found in {path}")
-    stream = video_streams[0]
-    duration = float(stream['duration'])
-    width = int(stream['width'])
-    height = int(stream['height'])
-    return duration, width, height
+    return info.video_duration, info.width, info.height
 
 def has_audio(path):
     try:
-        probe = ffmpeg.probe(path)
-        astreams = [s for s in probe.get('streams', []) if s.get('codec_type') == 'audio']
-        return len(astreams) > 0
+        return media_probe.probe(path).has_audio
     except Exception:
         return False
 
-for main_video in raw_short_videos:
-    main_path = os.path.join(raw_short_folder, main_video)
-    random_brainrot = os.path.join(brainrot_folder, random.choice(brainrot_videos))
+_digest_memo = {}
 
-    main_duration, main_w, main_h = get_video_info(main_path)
-    brainrot_duration, _, _ = get_video_info(random_brainrot)
-
-    # Loop or trim brainrot to match main video duration
-    temp_brainrot = os.path.join(output_folder, f"temp_brainrot_{main_video}")
-    temp_brainrot_trimmed = os.path.join(output_folder, f"temp_brainrot_trimmed_{main_video}")
-    if brainrot_duration < main_duration:
-        # Loop brainrot
-        n_loops = int(main_duration // brainrot_duration) + 1
-        inputs = [ffmpeg.input(random_brainrot) for _ in range(n_loops)]
-        concat = ffmpeg.concat(*inputs, v=1, a=0).node
-        v = concat[0]
-        # Normalize to constant FPS to avoid timing drift
-        ffmpeg.output(v, temp_brainrot, vcodec='libx264', r=FPS).run(overwrite_output=True)
-        # Trim to exact duration (write to new file)
-        ffmpeg.input(temp_brainrot).output(temp_brainrot_trimmed, t=main_duration, vcodec='libx264', r=FPS).run(overwrite_output=True)
-        os.remove(temp_brainrot)
-    else:
-        # Trim brainrot (write to new file)
-        ffmpeg.input(random_brainrot).output(temp_brainrot_trimmed, t=main_duration, vcodec='libx264', r=FPS).run(overwrite_output=True)
+def _digest_file():
+    return os.path.join(BACKGROUND_CACHE_DIR, 'digests.json')
 
+def _load_digests():
+    # {abspath: [size, mtime_ns, sha256]} from the sidecar next to the mezzanines; empty if missing or unreadable
+    try:
+        with open(_digest_file(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    # Prepare streams for vertical stack to 1080x1920: make each half 1080x960
-    crop_w, crop_h = 1080, 1920
-    half_h = crop_h // 2
-    temp_main_cropped = os.path.join(output_folder, f"temp_main_cropped_{main_video}")
-    temp_brainrot_cropped = os.path.join(output_folder, f"temp_brainrot_cropped_{main_video}")
+def _store_digest(key, digest):
+    # Read-modify-replace: a concurrent writer can drop an entry, which only costs one extra hash later
+    entries = {path: entry for path, entry in _load_digests().items() if os.path.exists(path)}
+    entries[key[0]] = [key[1], key[2], digest]
+    tmp_path = f"{_digest_file()}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(BACKGROUND_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, _digest_file())
+    except OSError:
+        pass
 
-    # Main video top panel framing
-    if MAIN_FILL_MODE == 'fill':
-        # Fill: scale up maintaining AR, then crop to 1080x960; apply extra zoom via scale multiplier
-        # Compute scale multiplier from percentage; e.g., 110 -> 1.1
-        zoom_mult = max(1.0, float(MAIN_ZOOM_PERCENT) / 100.0)
-        # We implement extra zoom by scaling to a larger box then cropping back to target area.
-        # First, scale to fill the target box; then up-scale by zoom_mult; crop back to exact size.
-        vf_chain = (
-            f"scale={crop_w}:{half_h}:force_original_aspect_ratio=increase,"
-            f"scale=iw*{zoom_mult}:ih*{zoom_mult},"
-            f"crop={crop_w}:{half_h}"
-        )
-    else:
-        # Pad: scale down if needed keeping entire frame, then pad to center
-        vf_chain = (
-            f"scale={crop_w}:{half_h}:force_original_aspect_ratio=decrease,"
-            f"pad={crop_w}:{half_h}:(ow-iw)/2:(oh-ih)/2"
-        )
+def file_digest(path):
+    # Content hash, kept per (path, size, mtime) in memory and in the BACKGROUND_CACHE_DIR sidecar, so a clip
+    # is only read again after it changes (and pool workers reuse the hash the parent computed)
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _digest_memo:
+        stored = _load_digests().get(key[0])
+        if stored and tuple(stored[:2]) == key[1:]:
+            _digest_memo[key] = stored[2]
+        else:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            _digest_memo[key] = h.hexdigest()
+            _store_digest(key, _digest_memo[key])
+    return _digest_memo[key]
 
-    ffmpeg.input(main_path).output(
-        temp_main_cropped,
-        vf=f"{vf_chain},fps={FPS},setpts=PTS-STARTPTS,format=yuv420p",
-        vcodec='libx264',
-        crf=CRF,
-        r=FPS,
-        threads=THREADS
-    ).run(overwrite_output=True)
-
-    # Zoom in and center crop brainrot video (no pad, always fill)
-    ffmpeg.input(temp_brainrot_trimmed).output(
-        temp_brainrot_cropped,
-        vf=f"scale={crop_w}:{half_h}:force_original_aspect_ratio=increase,crop={crop_w}:{half_h},fps={FPS},setpts=PTS-STARTPTS,format=yuv420p",
-        vcodec='libx264',
-        crf=CRF,
-        r=FPS,
-        threads=THREADS
-    ).run(overwrite_output=True)
-    os.remove(temp_brainrot_trimmed)
+def get_background_mezzanine(src, width, height, fps=FPS, threads=THREADS):
+    settings = f"v1|{width}x{height}|fps={fps}|gop={MEZZANINE_GOP}|crf={MEZZANINE_CRF}"
+    digest = hashlib.sha256(f"{file_digest(src)}|{settings}".encode()).hexdigest()[:16]
+    # Named by the full source file name, so clips that only differ in extension (a.mp4, a.mov) keep separate entries
+    name = os.path.basename(src)
+    mezzanine = os.path.join(BACKGROUND_CACHE_DIR, f"{name}.{digest}.mp4")
+    if os.path.exists(mezzanine):
+        return mezzanine
 
-    # Stack vertically and add main video audio
-    output_path = os.path.join(output_folder, f"combined_{main_video}")
-    main_in = ffmpeg.input(temp_main_cropped)
-    brain_in = ffmpeg.input(temp_brainrot_cropped)
-    stacked = ffmpeg.filter([main_in.video, brain_in.video], 'vstack')
-    # Output stacked video with audio handling:
-    # - If KEEP_ORIGINAL_AUDIO and main has audio, include it with ORIGINAL_AUDIO_VOLUME.
-    # - If USE_NEW_AUDIO and NEW_AUDIO_FILE exists, include it with NEW_AUDIO_VOLUME; loop/trim to match.
-    # - If neither present, output silence.
-    main_has_audio = has_audio(main_path)
-    audio_streams = []
-    if KEEP_ORIGINAL_AUDIO and main_has_audio:
-        a = main_in.audio
-        if abs(ORIGINAL_AUDIO_VOLUME - 1.0) > 1e-3:
-            a = a.filter('volume', volume=ORIGINAL_AUDIO_VOLUME)
-        audio_streams.append(a)
-    new_audio_in = None
+    os.makedirs(BACKGROUND_CACHE_DIR, exist_ok=True)
+    print(f"Building background mezzanine for {os.path.basename(src)}")
+    # Write under a per-process name and rename, so concurrent jobs never read a half-written entry
+    tmp_path = f"{mezzanine}.{os.getpid()}.tmp.mp4"
+    (
+        ffmpeg.input(src).video
+        .filter('fps', fps)
+        .filter('scale', width, height, force_original_aspect_ratio='increase')
+        .filter('crop', width, height)
+        .filter('setsar', 1)
+        .filter('format', 'yuv420p')
+        .output(tmp_path, vcodec='libx264', crf=MEZZANINE_CRF, preset='veryfast', g=MEZZANINE_GOP,
+                an=None, threads=threads)
+        .run(overwrite_output=True)
+    )
+    os.replace(tmp_path, mezzanine)
+
+    # Drop entries built from an older version of this clip or with older settings
+    for f in os.listdir(BACKGROUND_CACHE_DIR):
+        parts = f.rsplit('.', 2)
+        if len(parts) == 3 and parts[0] == name and parts[2] == 'mp4' and f != os.path.basename(mezzanine):
+            try:
+                os.remove(os.path.join(BACKGROUND_CACHE_DIR, f))
+            except OSError:
+                pass
+    return mezzanine
+
+def list_videos(folder, extensions):
+    return [f for f in os.listdir(folder) if f.endswith(extensions)]
+
+def choose_new_audio():
     # Build candidate list from audio_folder
     candidates = []
     try:
@@ -233,21 +266,111 @@ for main_video in raw_short_videos:
         # Priority 4: deterministic fallback to first by name
         elif candidates:
             chosen_new_audio = sorted(candidates)[0]
-    if chosen_new_audio and os.path.exists(chosen_new_audio):
-        # Load new audio; loop or trim to main duration
-        new_audio_input = ffmpeg.input(chosen_new_audio)
-        # atrim ensures exact duration; aevalsrc of 0 isn't needed here
-        a_stream = new_audio_input.audio.filter('aloop', size=int(FPS*2), loops=100000) if False else new_audio_input.audio
+    return chosen_new_audio
+
+def build_short(main_path, background, audio, settings=None):
+    # Render one short: main video on top, background below, audio = original and/or `audio` (may be None)
+    if settings is None:
+        settings = default_settings()
+    fps = settings['fps']
+    crf = settings['crf']
+    threads = settings['threads']
+    main_video = os.path.basename(main_path)
+    out_folder = settings['output_folder']
+
+    main_duration, main_w, main_h = get_video_info(main_path)
+
+    # Everything below is one filter graph encoded once:
+    # top = main video framed to 1080x960, bottom = looped/trimmed brainrot filled to 1080x960, vstacked to 1080x1920
+    crop_w, crop_h = STACK_W, STACK_H
+    half_h = crop_h // 2
+    main_in = ffmpeg.input(main_path)
+
+    # Main video top panel framing
+    top = main_in.video
+    if settings['main_fill_mode'] == 'fill':
+        # Fill: scale up maintaining AR, then crop to 1080x960; apply extra zoom via scale multiplier
+        # Compute scale multiplier from percentage; e.g., 110 -> 1.1
+        zoom_mult = max(1.0, float(settings['main_zoom_percent']) / 100.0)
+        # We implement extra zoom by scaling to a larger box then cropping back to target area.
+        # First, scale to fill the target box; then up-scale by zoom_mult; crop back to exact size.
+        top = (
+            top.filter('scale', crop_w, half_h, force_original_aspect_ratio='increase')
+            .filter('scale', f'iw*{zoom_mult}', f'ih*{zoom_mult}')
+            .filter('crop', crop_w, half_h)
+        )
+    else:
+        # Pad: scale down if needed keeping entire frame, then pad to center
+        top = (
+            top.filter('scale', crop_w, half_h, force_original_aspect_ratio='decrease')
+            .filter('pad', crop_w, half_h, '(ow-iw)/2', '(oh-ih)/2')
+        )
+    top = top.filter('fps', fps).filter('setpts', 'PTS-STARTPTS').filter('format', 'yuv420p')
+
+    if settings['use_background_cache']:
+        # Already framed to 1080x960@FPS: seek to a random window (looping if the clip is too short)
+        mezzanine = get_background_mezzanine(background, crop_w, half_h, fps, threads)
+        mezzanine_duration, _, _ = get_video_info(mezzanine)
+        if mezzanine_duration > main_duration:
+            start = int(random.uniform(0, mezzanine_duration - main_duration) * fps) / fps
+            brain_in = ffmpeg.input(mezzanine, ss=start)
+        else:
+            brain_in = ffmpeg.input(mezzanine, stream_loop=-1)
+        bottom = (
+            brain_in.video
+            .filter('trim', duration=main_duration)
+            .filter('setpts', 'PTS-STARTPTS')
+        )
+    else:
+        # Loop the background endlessly; trim cuts it to the main video's length
+        brain_in = ffmpeg.input(background, stream_loop=-1)
+        # Zoom in and center crop brainrot video (no pad, always fill)
+        bottom = (
+            brain_in.video
+            .filter('fps', fps)
+            .filter('trim', duration=main_duration)
+            .filter('setpts', 'PTS-STARTPTS')
+            .filter('scale', crop_w, half_h, force_original_aspect_ratio='increase')
+            .filter('crop', crop_w, half_h)
+            .filter('format', 'yuv420p')
+        )
+
+    # Optionally tap both halves into their own files from the same graph (debugging only)
+    debug_outputs = []
+    if settings['debug_intermediates']:
+        top_split = top.split()
+        bottom_split = bottom.split()
+        top, bottom = top_split[0], bottom_split[0]
+        for stream, name in ((top_split[1], f"temp_main_cropped_{main_video}"), (bottom_split[1], f"temp_brainrot_cropped_{main_video}")):
+            debug_outputs.append(ffmpeg.output(
+                stream, os.path.join(out_folder, name),
+                vcodec='libx264', crf=crf, r=fps, threads=threads
+            ))
+
+    # Stack vertically and add main video audio
+    output_path = os.path.join(out_folder, f"combined_{main_video}")
+    stacked = ffmpeg.filter([top, bottom], 'vstack')
+    # Output stacked video with audio handling:
+    # - If keep_original_audio and main has audio, include it with original_audio_volume.
+    # - If a new audio file was chosen, include it with new_audio_volume; trim to match.
+    # - If neither present, output silence.
+    main_has_audio = has_audio(main_path)
+    audio_streams = []
+    if settings['keep_original_audio'] and main_has_audio:
+        a = main_in.audio
+        if abs(settings['original_audio_volume'] - 1.0) > 1e-3:
+            a = a.filter('volume', volume=settings['original_audio_volume'])
+        audio_streams.append(a)
+    if audio and os.path.exists(audio):
+        # Load new audio; trim to main duration
+        a_stream = ffmpeg.input(audio).audio
         # Apply volume
-        if abs(NEW_AUDIO_VOLUME - 1.0) > 1e-3:
-            a_stream = a_stream.filter('volume', volume=NEW_AUDIO_VOLUME)
+        if abs(settings['new_audio_volume'] - 1.0) > 1e-3:
+            a_stream = a_stream.filter('volume', volume=settings['new_audio_volume'])
         # Force duration
         a_stream = a_stream.filter('atrim', duration=main_duration).filter('asetpts', 'N/SR/TB')
         audio_streams.append(a_stream)
-        try:
-            print(f"Using background audio: {os.path.basename(chosen_new_audio)}")
-        except Exception:
-            pass
+        print(f"Using background audio: {os.path.basename(audio)}")
 
     if len(audio_streams) == 0:
         silence = ffmpeg.input("anullsrc=r=44100:cl=stereo", f="lavfi", t=main_duration)
@@ -259,27 +382,112 @@ for main_video in raw_short_videos:
         out_audio = ffmpeg.filter(audio_streams, 'amix', inputs=len(audio_streams), duration='first', dropout_transition=0)
         # optional: dynaudnorm or loudnorm could go here; keeping simple
 
-    ffmpeg.output(
+    final = ffmpeg.output(
         stacked,
         out_audio,
         output_path,
         vcodec='libx264',
         acodec='aac',
-        r=FPS,
+        r=fps,
         pix_fmt='yuv420p',
-        crf=CRF,
-        threads=THREADS,
-        t=main_duration
-    ).run(overwrite_output=True)
+        crf=crf,
+        threads=threads,
+        t=main_duration,
+        **mp4_output.output_args(duration=main_duration, fps=fps)
+    )
+    ffmpeg.merge_outputs(final, *debug_outputs).run(overwrite_output=True)
+    return output_path
 
-    # Clean up temp files
-    os.remove(temp_main_cropped)
-    os.remove(temp_brainrot_cropped)
+def describe_error(e):
+    # Plain-string form of a worker error: results cross the process pool pickled, and ffmpeg.Error can't be
+    # unpickled (its __init__ needs cmd, stdout, stderr), so returning it would break the whole pool
+    stderr = getattr(e, 'stderr', None)
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode('utf-8', 'replace')
+    return f"{e}: {stderr.strip()}" if stderr else f"{type(e).__name__}: {e}"
+
+def process_short(main_path, background, audio, settings):
+    # Pool worker: render one short, then optionally delete its source. Returns (main_path, error message or None).
+    try:
+        build_short(main_path, background, audio, settings)
+    except Exception as e:
+        return main_path, describe_error(e)
 
     # Optionally delete processed video
-    if DELETE_OLD_VIDEOS:
+    if settings['delete_old_videos']:
         try:
             os.remove(main_path)
             print(f"Deleted {main_path}")
         except Exception as e:
             print(f"Error deleting {main_path}: {e}")
+    return main_path, None
+
+def _build_mezzanine(background, settings):
+    # Pool worker: returns (background, error message or None); a failed build is retried, and reported, by its shorts
+    try:
+        get_background_mezzanine(background, STACK_W, STACK_H // 2, settings['fps'], settings['threads'])
+    except Exception as e:
+        return background, describe_error(e)
+    return background, None
+
+def plan_batch(jobs=None, total_threads=None):
+    # Split the thread budget so jobs * threads never exceeds it; 0/None jobs = as many THREADS-sized jobs as fit
+    total_threads = max(1, total_threads or TOTAL_THREADS)
+    jobs = jobs or BATCH_JOBS or max(1, total_threads // THREADS)
+    jobs = max(1, min(jobs, total_threads))
+    return jobs, max(1, total_threads // jobs)
+
+def run_batch(jobs=None, total_threads=None, settings=None):
+    os.makedirs(output_folder, exist_ok=True)
+
+    brainrot_videos = list_videos(brainrot_folder, BRAINROT_EXTENSIONS)
+    if not brainrot_videos:
+        raise ValueError("No videos found in brainrot folder!")
+
+    raw_short_videos = list_videos(raw_short_folder, RAW_SHORT_EXTENSIONS)
+    if not raw_short_videos:
+        raise ValueError("No videos found in raw_short folder!")
+    # One bulk probe up front; workers then hit the shared on-disk probe cache
+    media_probe.probe_many([os.path.join(raw_short_folder, v) for v in raw_short_videos])
+
+    jobs, threads = plan_batch(jobs, total_threads)
+    settings = default_settings(**dict(settings or {}, threads=threads))
+    print(f"Rendering {len(raw_short_videos)} shorts: {jobs} at a time, {threads} ffmpeg threads each")
+
+    # Random picks happen here, not in the workers, so forked workers don't share one RNG state
+    tasks = [
+        (os.path.join(raw_short_folder, v), os.path.join(brainrot_folder, random.choice(brainrot_videos)), choose_new_audio())
+        for v in raw_short_videos
+    ]
+
+    if settings['use_background_cache']:
+        # Hash each background once here; workers then read the digest from the sidecar instead of the clip
+        for background in sorted({background for _, background, _ in tasks}):
+            file_digest(background)
+
+    failures = []
+    if jobs == 1:
+        results = [process_short(main_path, background, audio, settings) for main_path, background, audio in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # Build each distinct mezzanine once up front so concurrent shorts don't race to create it
+            if settings['use_background_cache']:
+                backgrounds = sorted({background for _, background, _ in tasks})
+                for background, error in pool.map(_build_mezzanine, backgrounds, [settings] * len(backgrounds)):
+                    if error is not None:
+                        print(f"Failed to build mezzanine for {os.path.basename(background)}: {error}")
+            futures = [pool.submit(process_short, main_path, background, audio, settings) for main_path, background, audio in tasks]
+            results = [f.result() for f in futures]
+    for main_path, error in results:
+        if error is not None:
+            print(f"Failed {os.path.basename(main_path)}: {error}")
+            failures.append(main_path)
+    print(f"Summary: {len(results) - len(failures)} succeeded, {len(failures)} failed")
+    return failures
+
+def main():
+    failures = run_batch()
+    raise SystemExit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Small content-addressed file cache shared by the scripts in this folder.
+
+Entries are plain files in one directory, named by a hex key built from
+everything the content depends on (make_key). Reading an entry touches its
+mtime, so pruning oldest-mtime-first keeps the cache least-recently-used
+within max_bytes. Entries are written to a temp file in the cache directory
+and renamed into place, so readers never see a partial file, and building
+a missing entry holds a per-key lock so concurrent jobs that need the same
+entry encode it once. Lock files are left in place; prune removes ones
+that have been idle for LOCK_MAX_AGE seconds.
+"""
+
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, concurrent builders may just duplicate work
+    fcntl = None
+
+LOCK_MAX_AGE = 24 * 60 * 60
+
+
+def make_key(*parts):
+    # sha256 over the parts; bytes are hashed as-is, anything else by its repr
+    h = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else repr(part).encode('utf-8')
+        h.update(len(data).to_bytes(8, 'little'))
+        h.update(data)
+    return h.hexdigest()
+
+
+@contextlib.contextmanager
+def _locked(lock_path):
+    if fcntl is None:
+        yield
+        return
+    while True:
+        f = open(lock_path, 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        # prune may have unlinked the file between our open and flock; a lock on that inode excludes no one
+        try:
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(lock_path)):
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        os.utime(lock_path)  # in use: keep prune off it
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+def _remove_idle_lock(lock_path, now):
+    # Unlink a lock file nobody has used for LOCK_MAX_AGE, holding it while we do so _locked waiters retry
+    if fcntl is None:
+        return
+    try:
+        if now - os.stat(lock_path).st_mtime < LOCK_MAX_AGE:
+            return
+        with open(lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(lock_path)):
+                os.remove(lock_path)
+    except OSError:  # in use, or already gone
+        pass
+
+
+def link_or_copy(src, dest):
+    # Hard link where possible (instant, and survives the entry being pruned), else copy
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+    return dest
+
+
+class FileCache:
+    def __init__(self, directory, max_bytes, suffix=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        # Path of the entry, or None. Touching it marks it recently used.
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def get_or_create(self, key, build, prune=True):
+        # Path of the entry, calling build(tmp_path) to write it first if it's missing. Callers storing many
+        # entries in one go can pass prune=False and call prune() once at the end.
+        path = self.get(key)
+        if path:
+            return path
+        os.makedirs(self.directory, exist_ok=True)
+        with _locked(os.path.join(self.directory, key + '.lock')):
+            path = self.get(key)  # another job may have built it while we waited
+            if path:
+                return path
+            fd, tmp_path = tempfile.mkstemp(prefix=key + '.', suffix='.tmp' + self.suffix, dir=self.directory)
+            os.close(fd)
+            try:
+                build(tmp_path)
+                os.replace(tmp_path, self.path(key))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        if prune:
+            self.prune()
+        return self.path(key)
+
+    def put_bytes(self, key, data, prune=True):
+        return self.get_or_create(key, lambda tmp_path: _write_bytes(tmp_path, data), prune)
+
+    def prune(self):
+        # Drop least-recently-used entries until the cache fits max_bytes
+        with _locked(os.path.join(self.directory, '.prune.lock')):
+            entries = []
+            now = time.time()
+            for name in os.listdir(self.directory):
+                if name.endswith('.lock') and not name.startswith('.'):
+                    _remove_idle_lock(os.path.join(self.directory, name), now)
+                    continue
+                if name.startswith('.') or '.tmp' in name or not name.endswith(self.suffix):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.directory, name))
+                    total -= size
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
@@ -0,0 +1,229 @@
+"""
+Shared ffprobe layer used by every script in this folder.
+
+probe() returns a MediaInfo record and caches the raw ffprobe output both in
+memory and in an on-disk SQLite cache keyed by (path, size, mtime), so a file
+is only ever probed once until it changes. probe_many() probes a whole folder
+listing in one go: cached entries are read in a single query and the misses
+are probed concurrently.
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+CACHE_PATH = os.environ.get(
+    'MEDIA_PROBE_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'video_creation_help', 'probe_cache.sqlite3'),
+)
+PROBE_WORKERS = 8  # concurrent ffprobe processes for probe_many
+
+
+class ProbeError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    path: str
+    duration: Optional[float]        # container duration, else the first stream that reports one
+    has_video: bool
+    width: Optional[int]
+    height: Optional[int]
+    fps: Optional[float]
+    video_codec: Optional[str]
+    video_duration: Optional[float]  # duration of the first video stream (falls back to duration)
+    has_audio: bool
+    audio_codec: Optional[str]
+    sample_rate: Optional[int]
+    channels: Optional[int]
+    # Raw ffprobe dicts for anything the typed fields don't cover
+    video_stream: Optional[dict] = field(default=None, repr=False, compare=False)
+    audio_stream: Optional[dict] = field(default=None, repr=False, compare=False)
+    format: dict = field(default_factory=dict, repr=False, compare=False)
+
+
+def parse_rate(rate_str):
+    # "30000/1001" -> 29.97; None for missing or 0/0 rates
+    try:
+        if not rate_str or rate_str == "0/0":
+            return None
+        if "/" in rate_str:
+            n, d = rate_str.split("/")
+            return float(n) / float(d) if float(d) != 0 else None
+        return float(rate_str)
+    except Exception:
+        return None
+
+
+def _float_or_none(value):
+    try:
+        return float(value) if value not in (None, '', 'N/A') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def media_info_from_ffprobe(path, data):
+    streams = data.get('streams', [])
+    fmt = data.get('format', {})
+    vstreams = [s for s in streams if s.get('codec_type') == 'video']
+    astreams = [s for s in streams if s.get('codec_type') == 'audio']
+    v = vstreams[0] if vstreams else None
+    a = astreams[0] if astreams else None
+
+    duration = _float_or_none(fmt.get('duration'))
+    if not duration:
+        duration = next((_float_or_none(s['duration']) for s in streams if _float_or_none(s.get('duration'))), None)
+    video_duration = (_float_or_none(v.get('duration')) or duration) if v else None
+
+    return MediaInfo(
+        path=path,
+        duration=duration,
+        has_video=v is not None,
+        width=int(v['width']) if v and v.get('width') else None,
+        height=int(v['height']) if v and v.get('height') else None,
+        fps=parse_rate(v.get('avg_frame_rate') or v.get('r_frame_rate')) if v else None,
+        video_codec=v.get('codec_name') if v else None,
+        video_duration=video_duration,
+        has_audio=a is not None,
+        audio_codec=a.get('codec_name') if a else None,
+        sample_rate=int(a['sample_rate']) if a and a.get('sample_rate') else None,
+        channels=a.get('channels') if a else None,
+        video_stream=v,
+        audio_stream=a,
+        format=fmt,
+    )
+
+
+def run_ffprobe(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise ProbeError(f"ffprobe failed for {path}: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+
+_memo = {}  # (abspath, size, mtime_ns) -> MediaInfo
+_memo_lock = threading.Lock()
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def _connect():
+    os.makedirs(os.path.dirname(CACHE_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute('CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)')
+    return conn
+
+
+def _load_cached(keys):
+    # Returns {key: raw ffprobe dict} for keys whose size and mtime still match
+    found = {}
+    try:
+        conn = _connect()
+        try:
+            by_path = {k[0]: k for k in keys}
+            paths = list(by_path)
+            for i in range(0, len(paths), 500):
+                batch = paths[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT path, size, mtime_ns, data FROM probes WHERE path IN ({','.join('?' * len(batch))})", batch
+                )
+                for path, size, mtime_ns, data in rows:
+                    key = by_path[path]
+                    if (size, mtime_ns) == key[1:]:
+                        found[key] = json.loads(data)
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass  # cache unavailable (read-only home, locked too long, ...): just probe
+    return found
+
+
+def _store_cached(entries):
+    if not entries:
+        return
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO probes (path, size, mtime_ns, data) VALUES (?, ?, ?, ?)',
+                    [(k[0], k[1], k[2], json.dumps(data)) for k, data in entries.items()],
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def probe_many(paths, workers=PROBE_WORKERS, raise_errors=False):
+    """
+    Probe several files at once.
+
+    Returns {path: MediaInfo} keyed by the paths as given. Files that can't be
+    probed are left out, unless raise_errors is set.
+    """
+    results = {}
+    pending = {}  # stat key -> paths as given
+    for path in paths:
+        try:
+            key = _stat_key(path)
+        except OSError as e:
+            if raise_errors:
+                raise ProbeError(f"cannot probe {path}: {e}") from e
+            continue
+        with _memo_lock:
+            info = _memo.get(key)
+        if info is not None:
+            results[path] = info
+        else:
+            pending.setdefault(key, []).append(path)
+    if not pending:
+        return results
+
+    raw = _load_cached(list(pending))
+    misses = [k for k in pending if k not in raw]
+    fresh = {}
+    if misses:
+        def _probe(key):
+            try:
+                return key, run_ffprobe(key[0]), None
+            except Exception as e:
+                return key, None, e
+        if len(misses) == 1:
+            outcomes = [_probe(misses[0])]
+        else:
+            # Imported here so single-file CLI calls don't pay for it at startup
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(misses)))) as pool:
+                outcomes = list(pool.map(_probe, misses))
+        for key, data, error in outcomes:
+            if error is not None:
+                if raise_errors:
+                    raise error if isinstance(error, ProbeError) else ProbeError(str(error))
+                continue
+            fresh[key] = data
+        _store_cached(fresh)
+    raw.update(fresh)
+
+    for key, data in raw.items():
+        info = media_info_from_ffprobe(key[0], data)
+        with _memo_lock:
+            _memo[key] = info
+        for path in pending[key]:
+            results[path] = info
+    return results
+
+
+def probe(path):
+    return probe_many([path], raise_errors=True)[path]
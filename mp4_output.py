@@ -0,0 +1,124 @@
+"""
+MP4 container layout for the final outputs of every script in this folder.
+
+With +faststart ffmpeg writes the file with the moov atom (the sample index)
+at the end, then rewrites the whole file to move moov to the front, so every
+output is written twice. MP4_OUTPUT_MODE picks the layout instead:
+
+  faststart   moov at the front after a second full-file pass (default)
+  fragmented  fragmented MP4 (frag_keyframe+empty_moov): playable while it is
+              being written or downloaded, written once
+  reserved    moov written into space reserved at the front (moov_size), sized
+              from the duration and frame rate: front-loaded and written once
+  end         moov at the end: written once, but players must fetch the end of
+              the file before they can start
+
+Intermediate segments that only ever get re-read by ffmpeg should use "end".
+
+    python mp4_output.py INPUT [--dir DIR]
+
+remuxes INPUT once per mode into DIR (put it on the destination disk) and
+prints the bytes written per byte of output for each.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+MODES = ('faststart', 'fragmented', 'reserved', 'end')
+MP4_OUTPUT_MODE = os.environ.get('MP4_OUTPUT_MODE', 'faststart')
+
+# moov_size estimate: per-sample table entries (stsz/stts/ctts/stco/stss) for video plus audio, a fixed
+# allowance for the rest, and a safety factor. The muxer fails if moov doesn't fit, so err well on the big side.
+MOOV_BYTES_PER_VIDEO_FRAME = 24
+MOOV_BYTES_PER_AUDIO_FRAME = 12
+AUDIO_FRAMES_PER_SECOND = 48000 / 1024
+MOOV_BASE_BYTES = 64 * 1024
+MOOV_SAFETY = 2.0
+
+
+def reserved_moov_size(duration, fps):
+    per_second = fps * MOOV_BYTES_PER_VIDEO_FRAME + AUDIO_FRAMES_PER_SECOND * MOOV_BYTES_PER_AUDIO_FRAME
+    return int((MOOV_BASE_BYTES + duration * per_second) * MOOV_SAFETY)
+
+
+def output_args(mode=None, duration=None, fps=None):
+    # ffmpeg output kwargs for the chosen layout; "reserved" needs the output duration and frame rate and
+    # falls back to faststart without them
+    mode = mode or MP4_OUTPUT_MODE
+    if mode not in MODES:
+        raise ValueError(f"unknown MP4 output mode {mode!r} (expected one of {', '.join(MODES)})")
+    if mode == 'reserved' and not (duration and fps):
+        mode = 'faststart'
+    if mode == 'faststart':
+        return {'movflags': '+faststart'}
+    if mode == 'fragmented':
+        return {'movflags': '+frag_keyframe+empty_moov+default_base_moof'}
+    if mode == 'reserved':
+        return {'moov_size': reserved_moov_size(duration, fps)}
+    return {}
+
+
+def _bytes_written(cmd):
+    # Runs cmd and returns (bytes written, seconds). On Linux this is wchar from /proc/<pid>/io, read before the
+    # exited process is reaped: every byte handed to write(), including faststart's rewrite of pages that are
+    # still in the page cache. Elsewhere it falls back to ru_oublock (blocks that actually reached storage).
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    written = None
+    if hasattr(os, 'waitid'):
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        try:
+            with open(f'/proc/{proc.pid}/io') as f:
+                written = int(next(line.split()[1] for line in f if line.startswith('wchar:')))
+        except (OSError, StopIteration):
+            pass
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()[-500:]}")
+    if written is None:
+        written = usage.ru_oublock * 512
+    return written, time.perf_counter() - start
+
+
+def benchmark(input_path, out_dir='.'):
+    # Remux input_path once per mode and report write amplification (bytes written / output size)
+    import media_probe
+    info = media_probe.probe(input_path)
+    work_dir = tempfile.mkdtemp(prefix='mp4_output_bench_', dir=out_dir)
+    results = []
+    try:
+        for mode in MODES:
+            out_path = os.path.join(work_dir, f'{mode}.mp4')
+            cmd = ['ffmpeg', '-v', 'error', '-y', '-i', input_path, '-map', '0:v:0?', '-map', '0:a:0?', '-c', 'copy']
+            for key, value in output_args(mode, duration=info.duration, fps=info.fps).items():
+                cmd += [f'-{key}', str(value)]
+            cmd.append(out_path)
+            written, seconds = _bytes_written(cmd)
+            size = os.path.getsize(out_path)
+            results.append((mode, size, written, seconds))
+            os.remove(out_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare disk writes of the MP4 output modes by remuxing a file")
+    parser.add_argument('input', help="Sample output file (e.g. a finished ASMR video)")
+    parser.add_argument('--dir', default='.', help="Directory to write test outputs in (default: current directory)")
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'size MB':>10}{'written MB':>12}{'amplification':>15}{'seconds':>10}")
+    for mode, size, written, seconds in benchmark(args.input, args.dir):
+        amp = f"{written / size:.2f}x" if written else "n/a"
+        print(f"{mode:<12}{size / 1e6:>10.1f}{written / 1e6:>12.1f}{amp:>15}{seconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
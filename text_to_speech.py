@@ -1,10 +1,39 @@
+import base64
+import json
 import os
-from gtts import gTTS
+import re
+import threading
+import time
+import unicodedata
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import file_cache
 
 # 👇 Replace with your .txt filename
 TEXT_FILE_NAME = "Speechify_Video.txt"
 OUTPUT_NAME = "speech.mp3"
 
+# Google Translate's TTS RPC (the same one gTTS calls). Point TTS_ENDPOINT at a local stand-in server to test offline.
+TTS_ENDPOINT = os.environ.get("TTS_ENDPOINT", "https://translate.google.com/_/TranslateWebserverUi/data/batchexecute")
+TTS_RPC_ID = "jQ1olc"
+MAX_CHUNK_CHARS = 100  # the endpoint only reads about this much text per request
+TTS_WORKERS = 8        # concurrent requests
+TTS_RETRIES = 3        # extra attempts per chunk, with exponential backoff
+TTS_TIMEOUT = 20       # seconds per request
+SLOW = False           # slower speech
+
+# Synthesized chunks are cached by (normalized text, lang, voice settings, endpoint), so re-running an edited script
+# only synthesizes the sentences that changed. The cache is kept under TTS_CACHE_MAX_MB, least recently used first.
+USE_TTS_CACHE = True
+TTS_CACHE_DIR = os.environ.get(
+    'TTS_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'video_creation_help', 'tts'),
+)
+TTS_CACHE_MAX_MB = 256
+
 # Root and I/O settings
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(SCRIPT_DIR)
@@ -25,14 +54,132 @@ if not os.path.exists(TEXT_FILE_PATH):
     else:
         raise FileNotFoundError(f"Could not find '{TEXT_FILE_NAME}' in {SCRIPT_DIR} or {os.path.join(ROOT_DIR, 'Audio')}")
 
+_AUDIO_RE = re.compile(TTS_RPC_ID + r'","\[\\"(.*)\\"]')
+_HEADERS = {
+    "Referer": "http://translate.google.com/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Content-Type": "application/x-www-form-urlencoded;charset=utf-8",
+}
+_local = threading.local()
+
+
+class TTSError(RuntimeError):
+    pass
+
+
 def read_text_file(path):
     with open(path, 'r', encoding='utf-8') as file:
         return file.read()
 
+def _cut_point(sentence, max_chars):
+    # Where to break an over-long sentence: the last clause break, else the last space, else a hard cut
+    for pattern in (r'[,;:]\s', r'\s'):
+        breaks = [m.end() for m in re.finditer(pattern, sentence[:max_chars + 1])]
+        if breaks:
+            return breaks[-1]
+    return max_chars
+
+def split_text(text, max_chars=MAX_CHUNK_CHARS):
+    # One chunk per sentence, paragraphs never share a chunk, and sentences longer than max_chars are broken
+    # at clause boundaries
+    chunks = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = " ".join(paragraph.split())
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+            while len(sentence) > max_chars:
+                cut = _cut_point(sentence, max_chars)
+                chunks.append(sentence[:cut].strip())
+                sentence = sentence[cut:].strip()
+            if sentence:
+                chunks.append(sentence)
+    return chunks
+
+def _session():
+    # One Session per worker thread, so each keeps its connection to the endpoint open between chunks
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+        session.headers.update(_HEADERS)
+    return session
+
+def _request_body(text, lang, slow):
+    rpc = [[[TTS_RPC_ID, json.dumps([text, lang, True if slow else None, "null"]), None, "generic"]]]
+    return f"f.req={urllib.parse.quote(json.dumps(rpc, separators=(',', ':')))}&"
+
+def synthesize_chunk(text, lang="en", slow=SLOW, cancel=None):
+    # MP3 bytes for one chunk of text, retried with backoff on network errors and responses without audio.
+    # Setting the optional cancel Event stops the retries (another chunk already failed the job).
+    for attempt in range(TTS_RETRIES + 1):
+        try:
+            response = _session().post(TTS_ENDPOINT, data=_request_body(text, lang, slow), timeout=TTS_TIMEOUT)
+            response.raise_for_status()
+            for line in response.text.splitlines():
+                match = _AUDIO_RE.search(line)
+                if match:
+                    return base64.b64decode(match.group(1))
+            raise TTSError("no audio in response")
+        except (requests.RequestException, TTSError) as e:
+            if attempt == TTS_RETRIES:
+                raise TTSError(f"TTS failed for {text[:40]!r} after {attempt + 1} attempts: {e}") from e
+            if cancel is None:
+                time.sleep(0.5 * 2 ** attempt)
+            elif cancel.wait(0.5 * 2 ** attempt):
+                raise TTSError("cancelled") from e
+
+def cached_chunk(cache, text, lang="en", slow=SLOW, cancel=None):
+    # (MP3 bytes, whether they came from the cache) for one chunk, synthesizing and storing it on a miss
+    key = file_cache.make_key("tts", unicodedata.normalize("NFC", " ".join(text.split())), lang, slow, TTS_ENDPOINT)
+    path = cache.get(key)
+    if path:
+        try:
+            with open(path, "rb") as f:
+                return f.read(), True
+        except OSError:  # pruned by another run between get() and open()
+            pass
+    data = synthesize_chunk(text, lang, slow, cancel)
+    cache.put_bytes(key, data, prune=False)  # text_to_speech prunes once per run
+    return data, False
+
 def text_to_speech(text, output_file=OUTPUT_NAME, lang="en"):
-    tts = gTTS(text=text, lang=lang)
-    tts.save(output_file)
-    print(f"✅ Audio saved to {output_file}")
+    chunks = split_text(text)
+    if not chunks:
+        raise ValueError("No text to speak")
+    start = time.perf_counter()
+    cancel = threading.Event()
+    cache = file_cache.FileCache(TTS_CACHE_DIR, TTS_CACHE_MAX_MB * 1024 * 1024, suffix=".mp3") if USE_TTS_CACHE else None
+
+    def synthesize(chunk):
+        if cache is None:
+            return synthesize_chunk(chunk, lang, cancel=cancel), False
+        return cached_chunk(cache, chunk, lang, cancel=cancel)
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(TTS_WORKERS, len(chunks))) as pool:
+            futures = [pool.submit(synthesize, chunk) for chunk in chunks]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                # The output can't be completed: drop queued chunks and stop retries instead of waiting them out
+                cancel.set()
+                pool.shutdown(cancel_futures=True)
+                raise
+    finally:
+        # Once per run: prune lists and stats the whole cache, so doing it per stored chunk is quadratic
+        if cache is not None and os.path.isdir(TTS_CACHE_DIR):
+            cache.prune()
+    results = [future.result() for future in futures]
+    parts = [data for data, _ in results]
+    cached = sum(hit for _, hit in results)
+
+    # MP3 frames stand alone, so the parts join by plain concatenation in order (as gTTS saves multi-part text)
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        for part in parts:
+            f.write(part)
+    os.replace(tmp_file, output_file)
+    print(f"✅ Audio saved to {output_file} ({len(chunks)} chunks, {cached} from cache, "
+          f"in {time.perf_counter() - start:.1f}s)")
 
 def main():
     text = read_text_file(TEXT_FILE_PATH)
@@ -1,14 +1,29 @@
 # Script to process videos from 'old Coding/done', add neon text to first 0.5 seconds, and save to 'Old Coding2'
 import cv2
+import functools
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import os
 import random
+import shutil
 import subprocess
+import tempfile
+import media_probe
 
 OLD_DIR = '/Users/videos'
 NEW_DIR = '/Users/videos'
 FONT_SIZE = 110
+OVERLAY_SECONDS = 0.5  # how long the title stays on screen
+
+# Smart render: re-encode only up to the first keyframe after the overlay and stream-copy the rest.
+# Falls back to a full OpenCV re-encode when the source codec isn't listed or no keyframe is found.
+SMART_RENDER = True
+SMART_RENDER_MAX_HEAD = 20  # seconds searched for that keyframe
+SMART_RENDER_CRF = 16       # quality of the re-encoded head
+SMART_RENDER_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+# The head's parameter sets never match the source's, so the copied tail carries its own in-band at every keyframe
+# and the output uses the sample entry that allows in-band parameter sets
+SMART_RENDER_INBAND_TAGS = {'h264': 'avc3', 'hevc': 'hev1'}
 
 # 6 different neon colors
 NEON_COLORS = [
@@ -34,18 +49,24 @@ except:
 
 def has_audio(filepath):
     try:
-        result = subprocess.run(['ffprobe', '-i', filepath, '-show_streams', '-select_streams', 'a', '-loglevel', 'error'], capture_output=True, text=True)
-        return result.returncode == 0 and 'codec_type=audio' in result.stdout
-    except:
+        return media_probe.probe(filepath).has_audio
+    except Exception:
         return False
 
-def add_neon_text(frame, text, font, color):
-    # Convert frame to PIL Image
-    img_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(img_pil)
+def _composite(layer, im, x, y):
+    # alpha_composite rejects negative offsets, so crop off whatever hangs past the top/left edge
+    sx, sy = max(0, -x), max(0, -y)
+    if sx >= im.width or sy >= im.height:
+        return
+    layer.alpha_composite(im, dest=(max(0, x), max(0, y)), source=(sx, sy))
+
+def _render_neon_layer(text, font, color, width, height):
+    # Draw the title onto a transparent frame-sized RGBA layer
+    layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
     
     # Text wrapping
-    max_width = img_pil.width - 100  # margin
+    max_width = width - 100  # margin
     words = text.split()
     lines = []
     current_line = ""
@@ -63,6 +84,8 @@ def add_neon_text(frame, text, font, color):
             current_line = test_line
     if current_line:
         lines.append(current_line)
+    if not lines:
+        return layer
     
     # Angle for text
     angle = 5  # slight right tilt upward
@@ -112,8 +135,8 @@ def add_neon_text(frame, text, font, color):
     
     # Position lines
     total_height = sum(img.height for img in text_images) + (len(text_images) - 1) * 5
-    y_start = max(50, (img_pil.height - total_height) // 5)  # Ensure minimum margin from top
-    x_center = img_pil.width // 2
+    y_start = max(50, (height - total_height) // 5)  # Ensure minimum margin from top
+    x_center = width // 2
     
     # Draw semi-transparent black background behind all text
     bg_width = max(img.width for img in text_images) + 40  # Extra padding
@@ -122,28 +145,176 @@ def add_neon_text(frame, text, font, color):
     bg_y = y_start - 10
     # Create background rectangle with transparency
     bg_overlay = Image.new('RGBA', (bg_width, bg_height), (0, 0, 0, 120))  # Semi-transparent black
-    img_pil.paste(bg_overlay, (bg_x, bg_y), bg_overlay)
+    _composite(layer, bg_overlay, bg_x, bg_y)
     
     current_y = y_start
     for rotated in text_images:
         x = x_center - rotated.width // 2
-        img_pil.paste(rotated, (x, current_y), rotated)
+        _composite(layer, rotated, x, current_y)
         current_y += rotated.height + 5
     
-    # Convert back to OpenCV frame
-    return cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
+    return layer
+
+@functools.lru_cache(maxsize=8)
+def _neon_overlay(text, font, color, width, height):
+    # Render once per (text, font, color, resolution) and keep only the region the title covers,
+    # pre-multiplied in BGR so the per-frame blend is two integer ops on that ROI
+    rgba = np.asarray(_render_neon_layer(text, font, color, width, height))
+    ys, xs = np.nonzero(rgba[..., 3])
+    if len(ys) == 0:
+        return None
+    rows = slice(int(ys.min()), int(ys.max()) + 1)
+    cols = slice(int(xs.min()), int(xs.max()) + 1)
+    alpha = rgba[rows, cols, 3:].astype(np.uint16)
+    premult = rgba[rows, cols, 2::-1].astype(np.uint16) * alpha + 127  # +127 rounds the //255 below
+    inv_alpha = 255 - alpha
+    scratch = np.empty(premult.shape, dtype=np.uint16)
+    return rows, cols, premult, inv_alpha, scratch
+
+def add_neon_text(frame, text, font, color):
+    # Blend the cached title layer into the BGR frame in place
+    overlay = _neon_overlay(text, font, tuple(color), frame.shape[1], frame.shape[0])
+    if overlay is None:
+        return frame
+    rows, cols, premult, inv_alpha, scratch = overlay
+    roi = frame[rows, cols]
+    np.multiply(roi, inv_alpha, out=scratch)
+    scratch += premult
+    scratch //= 255
+    roi[...] = scratch
+    return frame
+
+def _first_keyframe_after(filepath, seconds):
+    # Only packet flags are read (no decoding), limited to the first SMART_RENDER_MAX_HEAD seconds
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', f'%+{SMART_RENDER_MAX_HEAD}',
+                             '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', filepath],
+                            capture_output=True, text=True, check=True)
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(',')
+        if 'K' in flags and pts not in ('', 'N/A') and float(pts) >= seconds:
+            keyframes.append(float(pts))
+    return min(keyframes) if keyframes else None
+
+def _encoder_args(stream):
+    # Encoder settings that keep the re-encoded head stream-compatible with the copied body
+    codec = stream['codec_name']
+    args = ['-c:v', SMART_RENDER_ENCODERS[codec], '-crf', str(SMART_RENDER_CRF), '-pix_fmt', stream['pix_fmt']]
+    profile = (stream.get('profile') or '').lower().replace(' ', '').replace(':', '')
+    profile = {'constrainedbaseline': 'baseline', 'high444predictive': 'high444'}.get(profile, profile)
+    if profile:
+        args += ['-profile:v', profile]
+    if codec == 'h264' and stream.get('level', 0) > 0:
+        args += ['-level', f"{stream['level'] / 10:.1f}"]
+    for key, option in (('color_range', '-color_range'), ('color_space', '-colorspace'),
+                        ('color_transfer', '-color_trc'), ('color_primaries', '-color_primaries')):
+        value = stream.get(key)
+        if value and value != 'unknown':
+            args += [option, value]
+    args += ['-video_track_timescale', stream['time_base'].split('/')[1]]
+    return args
+
+def _parameter_set_nal_types(codec, packet):
+    # NAL unit types in one length-prefixed (MP4) sample that are SPS/PPS (H.264) or VPS/SPS/PPS (HEVC)
+    types = set()
+    i = 0
+    while i + 5 <= len(packet):
+        size = int.from_bytes(packet[i:i + 4], 'big')
+        header = packet[i + 4]
+        nal_type = header & 0x1f if codec == 'h264' else (header >> 1) & 0x3f
+        if nal_type in ((7, 8) if codec == 'h264' else (32, 33, 34)):
+            types.add(nal_type)
+        i += 4 + size
+    return types
+
+def _has_inband_parameter_sets(filepath, codec, seconds):
+    # True when the first video sample at or before `seconds` (a keyframe) carries its own parameter sets
+    result = subprocess.run(['ffmpeg', '-v', 'error', '-ss', f'{seconds:.6f}', '-i', filepath, '-map', '0:v:0', '-frames:v', '1',
+                             '-c', 'copy', '-f', 'data', '-'], capture_output=True, check=True)
+    return len(_parameter_set_nal_types(codec, result.stdout)) == (2 if codec == 'h264' else 3)
+
+def smart_render_video(input_path, output_path, title_text, color):
+    # Re-encode only the frames before the first keyframe after the overlay window;
+    # the remaining GOPs are stream-copied and joined with the original audio.
+    # Returns False when the source can't be smart-rendered so the caller can fall back.
+    stream = media_probe.probe(input_path).video_stream
+    if not stream or stream.get('codec_name') not in SMART_RENDER_ENCODERS:
+        return False
+    start = float(stream.get('start_time') or 0)
+    keyframe = _first_keyframe_after(input_path, start + OVERLAY_SECONDS)
+    if keyframe is None:
+        return False
 
-def process_video(input_path, output_path, title_text):
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        return False
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width, height = int(stream['width']), int(stream['height'])
+    frames_to_modify = int(OVERLAY_SECONDS * fps)
+    head_frames = int(round((keyframe - start) * fps))
+
+    tmp_dir = tempfile.mkdtemp(prefix='.smart_render_', dir=os.path.dirname(os.path.abspath(output_path)))
+    head_path = os.path.join(tmp_dir, 'head.mp4')
+    tail_path = os.path.join(tmp_dir, 'tail.mp4')
+    list_path = os.path.join(tmp_dir, 'concat.txt')
+    try:
+        encoder = subprocess.Popen(['ffmpeg', '-y', '-v', 'error', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}',
+                                    '-r', stream['r_frame_rate'], '-i', '-'] + _encoder_args(stream) + ['-an', head_path],
+                                   stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        frame_count = 0
+        try:
+            while frame_count < head_frames:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if frame_count < frames_to_modify:
+                    frame = add_neon_text(frame, title_text, font, color)
+                encoder.stdin.write(frame.tobytes())
+                frame_count += 1
+        finally:
+            cap.release()
+            encoder.stdin.close()
+        stderr = encoder.stderr.read()
+        encoder.wait()
+        if encoder.returncode != 0 or frame_count < head_frames:
+            print(f"Warning: smart render head failed for {os.path.basename(input_path)}: {stderr.decode(errors='replace').strip()}")
+            return False
+
+        # Seek a fraction of a frame past the keyframe so rounding in pts_time can't land on the previous one.
+        # mp4toannexb + dump_extra put the source parameter sets in front of every tail keyframe; the MP4 muxer
+        # converts the samples back to length-prefixed NALs and keeps them.
+        subprocess.run(['ffmpeg', '-y', '-v', 'error', '-ss', f'{keyframe - start + 0.5 / fps:.6f}', '-i', input_path,
+                        '-map', '0:v:0', '-c', 'copy', '-bsf:v', f"{stream['codec_name']}_mp4toannexb,dump_extra=freq=keyframe",
+                        '-avoid_negative_ts', 'make_zero', tail_path],
+                       check=True, capture_output=True, text=True)
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write(f"file '{head_path}'\nfile '{tail_path}'\n")
+        subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-i', input_path,
+                        '-map', '0:v', '-map', '1:a?', '-c', 'copy', '-tag:v', SMART_RENDER_INBAND_TAGS[stream['codec_name']],
+                        output_path],
+                       check=True, capture_output=True, text=True)
+        if not _has_inband_parameter_sets(output_path, stream['codec_name'], keyframe - start + 0.5 / fps):
+            print(f"Warning: smart render lost the source parameter sets for {os.path.basename(input_path)}")
+            os.remove(output_path)
+            return False
+    except subprocess.CalledProcessError as e:
+        print(f"Warning: smart render failed for {os.path.basename(input_path)}")
+        print(f"ffmpeg stderr: {e.stderr}")
+        return False
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"Smart-rendered {head_frames} frames, stream-copied the rest: {os.path.basename(output_path)}")
+    return True
+
+def full_render_video(input_path, output_path, title_text, color):
     cap = cv2.VideoCapture(input_path)
     if not cap.isOpened():
         print(f"Error opening video: {input_path}")
-        return
-    
-    # Select a random neon color for this video
-    random_color = random.choice(NEON_COLORS)
+        return False
     
     fps = cap.get(cv2.CAP_PROP_FPS)
-    frames_to_modify = int(0.5 * fps)
+    frames_to_modify = int(OVERLAY_SECONDS * fps)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
@@ -155,7 +326,7 @@ def process_video(input_path, output_path, title_text):
         if not ret:
             break
         if frame_count < frames_to_modify:
-            frame = add_neon_text(frame, title_text, font, random_color)
+            frame = add_neon_text(frame, title_text, font, color)
         out.write(frame)
         frame_count += 1
 
@@ -176,6 +347,22 @@ def process_video(input_path, output_path, title_text):
                 os.remove(temp_output)
     else:
         print(f"No audio to preserve for: {os.path.basename(output_path)}")
+    return True
+
+def process_video(input_path, output_path, title_text):
+    # Select a random neon color for this video
+    random_color = random.choice(NEON_COLORS)
+
+    rendered = False
+    if SMART_RENDER:
+        try:
+            rendered = smart_render_video(input_path, output_path, title_text, random_color)
+        except (subprocess.CalledProcessError, media_probe.ProbeError, OSError, ValueError, KeyError) as e:
+            print(f"Warning: smart render unavailable for {os.path.basename(input_path)} ({e})")
+        if not rendered:
+            print(f"Falling back to full render for: {os.path.basename(input_path)}")
+    if not rendered and not full_render_video(input_path, output_path, title_text, random_color):
+        return
     
     print(f"Processed: {os.path.basename(input_path)} -> {os.path.basename(output_path)} (Title: '{title_text}', Color: {random_color})")
 
@@ -186,12 +373,13 @@ def main():
     if not os.path.exists(NEW_DIR):
         os.makedirs(NEW_DIR)
     
-    for filename in os.listdir(OLD_DIR):
-        if filename.lower().endswith('.mp4'):
-            title = os.path.splitext(filename)[0]
-            input_path = os.path.join(OLD_DIR, filename)
-            output_path = os.path.join(NEW_DIR, filename)
-            process_video(input_path, output_path, title)
+    filenames = [f for f in os.listdir(OLD_DIR) if f.lower().endswith('.mp4')]
+    media_probe.probe_many([os.path.join(OLD_DIR, f) for f in filenames])
+    for filename in filenames:
+        title = os.path.splitext(filename)[0]
+        input_path = os.path.join(OLD_DIR, filename)
+        output_path = os.path.join(NEW_DIR, filename)
+        process_video(input_path, output_path, title)
 
 if __name__ == "__main__":
     main()